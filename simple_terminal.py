@@ -6,18 +6,1406 @@ A basic command terminal implementation with file operations and system monitori
 
 import os
 import sys
+import codecs
+import errno
+import fnmatch
+import functools
+import gzip
+import bz2
+import lzma
+import stat
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import sqlite3
 import subprocess
 import shutil
+import signal
+import threading
 import psutil
+import queue
 import random
 import re
+import shlex
+import struct
+import tempfile
+import time
+import zlib
+from array import array
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+try:
+    import resource
+except ImportError:  # Windows has no rlimits or wait4
+    resource = None
+
+try:
+    import pygments
+    from pygments.formatters import TerminalFormatter
+    from pygments.lexer import RegexLexer
+    from pygments.lexers import get_lexer_for_filename, guess_lexer
+    from pygments.lexers.special import TextLexer
+    from pygments.token import Error as ErrorToken, Token, Whitespace
+    from pygments.util import ClassNotFound
+except ImportError:  # Highlighting is optional; cat --color falls back to plain text
+    pygments = None
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024
+HASH_ALGORITHMS = ('md5', 'sha1', 'sha256', 'blake2b')
+LOCATE_MAGIC = b'STLOC001'
+LOCATE_HEADER = struct.Struct('<8sIIQ')
+LOCATE_ENTRY = struct.Struct('<IQI')
+WC_CHUNK_SIZE = 8 * 1024 * 1024
+WC_PARALLEL_THRESHOLD = 64 * 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_QUEUE_CHUNKS = 4
+SORT_MEMORY_BUDGET = 256 * 1024 * 1024
+SORT_LINE_OVERHEAD = 64
+SORT_MERGE_FANIN = 64
+SORT_RUN_BUFFER = 1024 * 1024
+SORT_NUMBER_RE = re.compile(rb'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+# Full headers rather than bare prefixes, so text that happens to start with "BZh" stays text:
+# gzip magic plus the deflate method, bzip2 magic, block size and the first block (or
+# end-of-stream) marker, and the xz stream header magic
+COMPRESSION_MAGIC = (
+    (re.compile(rb'\x1f\x8b\x08'), gzip.open),
+    (re.compile(rb'BZh[1-9](?:1AY&SY|\x17rE8P\x90)'), bz2.open),
+    (re.compile(rb'\xfd7zXZ\x00'), lzma.open),
+)
+UTF8_CONTINUATION_BYTES = bytes(range(0x80, 0xC0))
+REGEX_META = set('.^$*+?{}[]\\|()')
+PROCESS_INDEX_TTL = 1.0
+RESULT_CACHE_BYTES = 16 * 1024 * 1024
+FRECENCY_MAX_RANK = 10000
+BUILTIN_COMMANDS = frozenset([
+    'help', 'exit', 'quit', 'pwd', 'ls', 'cd', 'mkdir', 'rm', 'cat', 'cp', 'mv', 'hash', 'du',
+    'updatedb', 'locate', 'watch', 'wc', 'json', 'pgrep', 'pkill', 'cache', 'iotop', 'nettop',
+    'parallel', 'ulimit', 'timeout', 'pushd', 'popd', 'dirs', 'z', 'export', 'unset',
+    'record', 'replay', 'less', 'grep', 'sort', 'uniq', 'echo', 'clear', 'sysinfo', 'ps', 'ascii',
+])
+SESSION_LOG_MAGIC = b'STREC001'
+SESSION_RECORD = struct.Struct('<ddII')
+HIGHLIGHT_CHECKPOINT_LINES = 200
+HIGHLIGHT_CACHE_FILES = 8
+PARSE_CACHE_SIZE = 1024
+GLOB_CACHE_SIZE = 256
+STATE_DIR = os.environ.get('SIMPLE_TERMINAL_HOME', os.path.join(os.path.expanduser('~'), '.simple_terminal'))
+
+
+class Failure(str):
+    """Output of a builtin that failed: $? becomes 1, && skips and || runs the next command
+
+    It is still a plain string to everything that prints, caches or pickles it.
+    """
+
+
+def _format_size(num_bytes):
+    """Format a byte count as a short human readable string"""
+    size = float(num_bytes)
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size < 1024 or unit == 'TB':
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+
+
+def _data_segments(fd, size):
+    """Yield (offset, length) ranges holding data, skipping holes in sparse files"""
+    if not hasattr(os, 'SEEK_DATA'):
+        yield 0, size
+        return
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # No more data past pos: the rest of the file is a hole
+                return
+            # Filesystem does not report holes, copy everything that is left
+            yield pos, size - pos
+            return
+        yield start, min(end, size) - start
+        pos = end
+
+
+def _copy_range(src_fd, dst_fd, offset, count):
+    """Copy a byte range between descriptors, in the kernel when possible"""
+    end = offset + count
+    while offset < end:
+        chunk = min(COPY_CHUNK_SIZE, end - offset)
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk, offset, offset)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+        if not copied and hasattr(os, 'sendfile'):
+            try:
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+                copied = os.sendfile(dst_fd, src_fd, offset, chunk)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK):
+                    raise
+        if not copied:
+            data = os.pread(src_fd, chunk, offset)
+            if not data:
+                break
+            copied = os.pwrite(dst_fd, data, offset)
+        offset += copied
+
+
+def _hash_file(job):
+    """Hash a single file; runs inside a worker process"""
+    path, algorithm = job
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= HASH_MMAP_THRESHOLD:
+            # Large files: let the page cache feed the hash without extra copies.
+            # Slicing the mmap itself would copy, so slice a memoryview of it, and
+            # release the view before the mapping closes
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, HASH_CHUNK_SIZE * 16):
+                        digest.update(view[offset:offset + HASH_CHUNK_SIZE * 16])
+        else:
+            buffer = bytearray(HASH_CHUNK_SIZE)
+            view = memoryview(buffer)
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def _try_hash_file(job):
+    """Hash a single file, returning (digest, None) or (None, reason) if it can't be read"""
+    try:
+        return _hash_file(job), None
+    except OSError as e:
+        return None, e.strerror or str(e)
+
+
+def _files_size(directory, names):
+    """Return the bytes used by the named files in directory, stat-ing each one afresh"""
+    total = 0
+    for name in names:
+        try:
+            st = os.lstat(os.path.join(directory, name))
+        except OSError:
+            continue
+        total += getattr(st, 'st_blocks', 0) * 512 or st.st_size
+    return total
+
+
+def _subtree_range(root):
+    """Return (root, low, high) so that `path = root OR low <= path < high` selects root's subtree"""
+    prefix = root.rstrip(os.sep) + os.sep
+    return root, prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def _walk_cached(root, cached, scan, empty):
+    """Walk a tree breadth-first on a thread pool, reusing cached entries of unchanged directories
+
+    Entries are tuples starting with the directory mtime_ns and ending with the
+    list of subdirectory paths. Returns ({path: entry}, [rescanned paths]).
+    """
+    def visit(path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            entry = cached.get(path)
+            if entry and entry[0] == mtime_ns:
+                return path, entry, False
+            return path, scan(path), True
+        except OSError:
+            return path, empty, False
+
+    tree = {}
+    rescanned = []
+    frontier = [root]
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+        while frontier:
+            next_frontier = []
+            for path, entry, scanned in pool.map(visit, frontier):
+                tree[path] = entry
+                if scanned:
+                    rescanned.append(path)
+                next_frontier.extend(entry[-1])
+            frontier = next_frontier
+    return tree, rescanned
+
+
+def _list_entries(path):
+    """Return (mtime_ns, file names, subdirectory paths) for one directory"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    files = []
+    subdirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    files.append(entry.name)
+            except OSError:
+                pass
+    return mtime_ns, files, subdirs
+
+
+def _trigrams(data):
+    """Return the set of case-folded byte trigrams in data, packed as 24-bit ints"""
+    data = data.lower()
+    return {data[i] << 16 | data[i + 1] << 8 | data[i + 2] for i in range(len(data) - 2)}
+
+
+def _write_locate_index(index_path, paths):
+    """Write a trigram index for paths, replacing index_path atomically
+
+    Layout: header, (n+1) path offsets, sorted trigram table of
+    (trigram, postings offset, count), uint32 postings, then the path blob.
+    """
+    postings = {}
+    offsets = array('Q', [0])
+    blob = bytearray()
+    for path_id, path in enumerate(paths):
+        encoded = os.fsencode(path)
+        blob += encoded
+        offsets.append(len(blob))
+        for gram in _trigrams(encoded):
+            ids = postings.get(gram)
+            if ids is None:
+                ids = postings[gram] = array('I')
+            ids.append(path_id)
+
+    keys = sorted(postings)
+    table_start = LOCATE_HEADER.size + offsets.itemsize * len(offsets)
+    postings_start = table_start + LOCATE_ENTRY.size * len(keys)
+    table = bytearray()
+    position = postings_start
+    for key in keys:
+        table += LOCATE_ENTRY.pack(key, position, len(postings[key]))
+        position += 4 * len(postings[key])
+
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(LOCATE_HEADER.pack(LOCATE_MAGIC, len(paths), len(keys), position))
+        offsets.tofile(f)
+        f.write(table)
+        for key in keys:
+            postings[key].tofile(f)
+        f.write(blob)
+    os.replace(tmp_path, index_path)
+
+
+def _required_literals(pattern, regex):
+    """Return literal substrings every match must contain (empty when none can be derived)"""
+    if not regex:
+        return [pattern]
+    if '|' in pattern:
+        return []
+    literals = []
+    groups = []
+    current = ''
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == '\\':
+            # Escaped characters might be classes (\d, \w), so end the run here
+            literals.append(current)
+            current = ''
+            i += 2
+            continue
+        if ch == '(' and pattern.startswith('(?', i) and not pattern.startswith('(?:', i):
+            # Lookarounds, flags and named groups are not worth interpreting
+            return []
+        if ch in '?*{':
+            # The previous character is optional
+            current = current[:-1]
+        if ch in REGEX_META:
+            literals.append(current)
+            current = ''
+            if ch == '(':
+                groups.append(len(literals))
+                if pattern.startswith('(?:', i):
+                    i += 2
+            elif ch == ')':
+                start = groups.pop() if groups else 0
+                if pattern[i + 1:i + 2] in ('?', '*', '{'):
+                    # An optional group requires none of its literals
+                    del literals[start:]
+            elif ch in '[{':
+                close = pattern.find(']' if ch == '[' else '}', i + 2 if ch == '[' else i + 1)
+                i = close if close != -1 else len(pattern)
+        else:
+            current += ch
+        i += 1
+    literals.append(current)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+# A word is a tuple of (kind, text) parts; kind is 'plain', 'double' or 'single'
+# ('single' also covers backslash-escaped characters, which are never expanded).
+SimpleCommand = namedtuple('SimpleCommand', 'words redirects source shell')
+
+SHELL_OPERATORS = ('&&', '||', ';', '|', '&')
+# A redirection operator with its optional file descriptor number, e.g. '>', '2>>', '2>&', '&>', '<<'
+REDIRECT_RE = re.compile(r'(\d*)(&>>|&>|>>|>&|>\||>|<<<|<<-|<<|<&|<>|<)')
+# Redirections builtins apply themselves; any other form hands the command to the system shell
+REDIRECT_OPERATORS = ('>', '>>', '<', '2>', '2>>')
+HEREDOC_OPERATORS = ('<<', '<<-')
+VARIABLE_RE = re.compile(r'\$(?:\{([A-Za-z_][A-Za-z0-9_]*)\}|([A-Za-z_][A-Za-z0-9_]*|\?))')
+
+
+def _tokenize(line):
+    """Split a command line into ('word', parts, start, end), ('op', op, start, end)
+    and ('redirect', op, start, end) tokens
+
+    Words also carry whether they contain command substitution, which only
+    the system shell can run. Tokenizing stops at a heredoc operator, since
+    the lines after it are the document rather than shell syntax.
+    """
+    tokens = []
+    i = 0
+    n = len(line)
+    while i < n:
+        ch = line[i]
+        if ch.isspace():
+            i += 1
+            continue
+        if ch == '#':
+            break
+        redirect = REDIRECT_RE.match(line, i)
+        if redirect and not (redirect.group(1) and redirect.group(2).startswith('&')):
+            fd, op = redirect.groups()
+            if op in ('>', '>>') and fd in ('', '1', '2') or op == '<' and fd in ('', '0'):
+                op = ('2' if fd == '2' else '') + op
+            else:
+                op = fd + op
+            tokens.append(('redirect', op, i, redirect.end()))
+            if op in HEREDOC_OPERATORS:
+                break
+            i = redirect.end()
+            continue
+        op = next((op for op in SHELL_OPERATORS if line.startswith(op, i)), None)
+        if op is not None:
+            tokens.append(('op', op, i, i + len(op)))
+            i += len(op)
+            continue
+
+        start = i
+        parts = []
+        plain = ''
+        substitution = False
+        while i < n and not line[i].isspace() and line[i] not in ';|&<>':
+            ch = line[i]
+            if ch == '\\':
+                if plain:
+                    parts.append(('plain', plain))
+                    plain = ''
+                if i + 1 < n:
+                    parts.append(('single', line[i + 1]))
+                i += 2
+            elif ch == "'":
+                end = line.find("'", i + 1)
+                if end == -1:
+                    raise ValueError("unterminated single quote")
+                if plain:
+                    parts.append(('plain', plain))
+                    plain = ''
+                parts.append(('single', line[i + 1:end]))
+                i = end + 1
+            elif ch == '"':
+                if plain:
+                    parts.append(('plain', plain))
+                    plain = ''
+                text = ''
+                i += 1
+                while i < n and line[i] != '"':
+                    if line[i] == '\\' and i + 1 < n and line[i + 1] in '"\\$`':
+                        # Escaped characters are literal, so they must not be expanded later
+                        parts.append(('double', text))
+                        parts.append(('single', line[i + 1]))
+                        text = ''
+                        i += 2
+                        continue
+                    if line.startswith('$(', i) or line[i] == '`':
+                        substitution = True
+                    text += line[i]
+                    i += 1
+                if i >= n:
+                    raise ValueError("unterminated double quote")
+                parts.append(('double', text))
+                i += 1
+            else:
+                if line.startswith('$(', i) or ch == '`':
+                    substitution = True
+                plain += ch
+                i += 1
+        if plain:
+            parts.append(('plain', plain))
+        tokens.append(('word', (tuple(parts), substitution), start, i))
+    return tokens
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_command_line(line):
+    """Parse a command line into a tuple of (operator, SimpleCommand) pairs
+
+    operator is None for the first command and ';', '&&' or '||' for the
+    ones after it. Commands using pipes, backgrounding or command
+    substitution are flagged shell=True and run by the system shell as
+    written, as are redirections other than REDIRECT_OPERATORS and 2>&1.
+    A line with a heredoc goes to the shell whole. Results are cached, so
+    repeated lines skip tokenizing.
+    """
+    commands = []
+    words, redirects = [], []
+    shell = False
+    start = None
+    connector = None
+    tokens = _tokenize(line)
+    if any(kind == 'redirect' and value in HEREDOC_OPERATORS for kind, value, _, _ in tokens):
+        return ((None, SimpleCommand((), (), line.strip(), True)),)
+    i = 0
+
+    def finish(end):
+        if not words and not redirects:
+            return False
+        commands.append((connector, SimpleCommand(tuple(words), tuple(redirects),
+                                                  line[start:end].strip(), shell)))
+        return True
+
+    while i < len(tokens):
+        kind, value, token_start, token_end = tokens[i]
+        if start is None:
+            start = token_start
+        if kind == 'word':
+            parts, substitution = value
+            words.append(parts)
+            shell = shell or substitution
+        elif kind == 'redirect':
+            if i + 1 >= len(tokens) or tokens[i + 1][0] != 'word':
+                raise ValueError(f"syntax error near '{value}'")
+            target = tokens[i + 1][1][0]
+            if value == '2>&' and target == (('plain', '1'),):
+                # Builtins never write to stderr, so merging it into stdout changes nothing
+                pass
+            elif value in REDIRECT_OPERATORS:
+                redirects.append((value, target))
+            else:
+                shell = True
+            i += 1
+        elif value in ('|', '&'):
+            if value == '|' and not words:
+                raise ValueError("syntax error near '|'")
+            shell = True
+        else:
+            if not finish(token_start):
+                raise ValueError(f"syntax error near '{value}'")
+            words, redirects, shell, start = [], [], False, None
+            connector = value
+        i += 1
+
+    if not finish(len(line)) and connector in ('&&', '||'):
+        raise ValueError(f"syntax error near '{connector}'")
+    return tuple(commands)
+
+
+def _command_text(argv):
+    """Join arguments back into a command line; a lone argument is taken verbatim, as sh -c and watch(1) do"""
+    return argv[0] if len(argv) == 1 else shlex.join(argv)
+
+
+@functools.lru_cache(maxsize=GLOB_CACHE_SIZE)
+def _compile_glob(pattern):
+    """Compile one glob path component into a match function"""
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def _has_magic(text):
+    return any(ch in text for ch in '*?[')
+
+
+def _expand_glob(pattern, cwd):
+    """Expand a glob pattern relative to cwd with os.scandir; returns sorted matches as written"""
+    bases = [os.sep if pattern.startswith(os.sep) else '']
+    components = [component for component in pattern.split(os.sep) if component]
+    for position, component in enumerate(components):
+        last = position == len(components) - 1
+        expanded = []
+        for base in bases:
+            if not _has_magic(component):
+                expanded.append(os.path.join(base, component))
+                continue
+            match = _compile_glob(component)
+            try:
+                with os.scandir(os.path.join(cwd, base) if base else cwd) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('.') and not component.startswith('.'):
+                            continue
+                        if match(entry.name) and (last or entry.is_dir()):
+                            expanded.append(os.path.join(base, entry.name))
+            except OSError:
+                pass
+        bases = expanded
+    return sorted(path for path in bases if os.path.lexists(os.path.join(cwd, path)))
+
+
+
+class LocateIndex:
+    """Memory-mapped view of an on-disk trigram path index"""
+
+    def __init__(self, index_path):
+        self.path = index_path
+        self.mtime_ns = os.stat(index_path).st_mtime_ns
+        with open(index_path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_paths, self.n_trigrams, self.blob_start = LOCATE_HEADER.unpack_from(self.mm, 0)
+        if magic != LOCATE_MAGIC:
+            raise ValueError(f"not a locate index: {index_path}")
+        self.offsets_start = LOCATE_HEADER.size
+        self.table_start = self.offsets_start + 8 * (self.n_paths + 1)
+
+    def get_path(self, path_id):
+        start, end = struct.unpack_from('<QQ', self.mm, self.offsets_start + 8 * path_id)
+        return os.fsdecode(self.mm[self.blob_start + start:self.blob_start + end])
+
+    def postings(self, gram):
+        """Binary search the trigram table and return the matching path ids"""
+        lo, hi = 0, self.n_trigrams
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, offset, count = LOCATE_ENTRY.unpack_from(self.mm, self.table_start + LOCATE_ENTRY.size * mid)
+            if key == gram:
+                ids = array('I')
+                ids.frombytes(self.mm[offset:offset + 4 * count])
+                return ids
+            if key < gram:
+                lo = mid + 1
+            else:
+                hi = mid
+        return array('I')
+
+    def candidates(self, literals):
+        """Return candidate path ids containing every trigram of literals, or None for a full scan"""
+        grams = set()
+        for literal in literals:
+            grams |= _trigrams(os.fsencode(literal))
+        if not grams:
+            return None
+        lists = sorted((self.postings(gram) for gram in grams), key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(ids)
+        return sorted(result)
+
+    def close(self):
+        self.mm.close()
+
+
+def _compression_opener(path):
+    """Return gzip.open, bz2.open or lzma.open if the file starts with that format's header"""
+    with open(path, 'rb') as f:
+        head = f.read(10)
+    for magic, opener in COMPRESSION_MAGIC:
+        if magic.match(head):
+            return opener
+    return None
+
+
+def _decompressed_chunks(path, opener):
+    """Yield the decompressed contents of path in chunks
+
+    A background thread decompresses while the caller processes earlier chunks;
+    the bounded queue caps memory at DECOMPRESS_QUEUE_CHUNKS chunks whatever
+    the archive size. The thread stops if the caller abandons the generator.
+    """
+    chunks = queue.Queue(maxsize=DECOMPRESS_QUEUE_CHUNKS)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            with opener(path, 'rb') as f:
+                while True:
+                    chunk = f.read(DECOMPRESS_CHUNK_SIZE)
+                    if not chunk or not put(chunk):
+                        break
+        except Exception as e:
+            put(e)
+        put(None)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        stop.set()
+        worker.join()
+
+
+def _file_chunks(path, start=0, end=None, chunk_size=WC_CHUNK_SIZE):
+    """Yield the bytes of path in chunks, decompressing gzip, bzip2 and xz files transparently
+
+    start and end select a byte range and only apply to uncompressed files.
+    """
+    opener = _compression_opener(path)
+    if opener is not None:
+        yield from _decompressed_chunks(path, opener)
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = float('inf') if end is None else end - start
+        while remaining > 0:
+            chunk = f.read(int(min(chunk_size, remaining)))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _file_lines(path):
+    """Yield the lines of a (possibly compressed) file as bytes, without line endings"""
+    partial = b''
+    for chunk in _file_chunks(path, chunk_size=DECOMPRESS_CHUNK_SIZE):
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        yield from lines
+    if partial:
+        yield partial
+
+
+def _read_text(path):
+    """Read a whole (possibly compressed) file as text"""
+    if _compression_opener(path) is None:
+        with open(path, 'r') as f:
+            return f.read()
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    parts = [decoder.decode(chunk) for chunk in _file_chunks(path)]
+    parts.append(decoder.decode(b'', final=True))
+    return "".join(parts)
+
+
+def _sort_key(line, first_field, last_field, numeric):
+    """Sort key for a line: whitespace-separated fields first..last (1-based), optionally as a number"""
+    if first_field:
+        line = b' '.join(line.split()[first_field - 1:last_field])
+    if numeric:
+        match = SORT_NUMBER_RE.match(line)
+        return float(match.group(1)) if match else 0.0
+    return line
+
+
+def _unique_lines(lines, key):
+    """Drop lines whose key equals the previous line's key"""
+    previous = marker = object()
+    for line in lines:
+        current = key(line) if key else line
+        if previous is marker or current != previous:
+            previous = current
+            yield line
+
+
+def _write_run(lines, directory):
+    """Write lines to a new temporary run file in directory and return its path"""
+    fd, path = tempfile.mkstemp(prefix='run-', dir=directory)
+    with os.fdopen(fd, 'wb', buffering=SORT_RUN_BUFFER) as f:
+        for line in lines:
+            f.write(line)
+            f.write(b'\n')
+    return path
+
+
+def _read_run(path):
+    """Yield the lines of a run file without their newlines"""
+    with open(path, 'rb', buffering=SORT_RUN_BUFFER) as f:
+        for line in f:
+            yield line[:-1]
+
+
+def _sort_run(job):
+    """Sort one chunk of lines in a worker process and spill it to a run file"""
+    lines, key, reverse, unique, directory = job
+    lines.sort(key=key, reverse=reverse)
+    return _write_run(_unique_lines(lines, key) if unique else lines, directory)
+
+
+def _merge_runs(paths, key, reverse, directory):
+    """K-way merge sorted run files, in several passes if there are more than SORT_MERGE_FANIN"""
+    while len(paths) > SORT_MERGE_FANIN:
+        # Merging neighbouring groups keeps runs in input order, so equal keys stay stable
+        merged_paths = []
+        for start in range(0, len(paths), SORT_MERGE_FANIN):
+            group = paths[start:start + SORT_MERGE_FANIN]
+            merged = heapq.merge(*(_read_run(path) for path in group), key=key, reverse=reverse)
+            merged_paths.append(_write_run(merged, directory))
+            for path in group:
+                os.remove(path)
+        paths = merged_paths
+    return heapq.merge(*(_read_run(path) for path in paths), key=key, reverse=reverse)
+
+
+def _count_range(job):
+    """Count lines, words, bytes and (optionally) chars in a byte range of a file
+
+    An end of None counts the whole file, which is how compressed files are
+    counted since their streams can't be split. Also returns whether the range
+    starts and ends inside a word so that words split across range boundaries
+    can be merged by the caller.
+    """
+    path, start, end, count_chars = job
+    lines = words = chars = size = 0
+    first_in_word = last_in_word = None
+    for chunk in _file_chunks(path, start, end):
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+        words += len(chunk.split())
+        starts_in_word = not chunk[:1].isspace()
+        if first_in_word is None:
+            first_in_word = starts_in_word
+        elif last_in_word and starts_in_word:
+            # The previous chunk ended mid-word
+            words -= 1
+        last_in_word = not chunk[-1:].isspace()
+        if count_chars:
+            chars += len(chunk.translate(None, UTF8_CONTINUATION_BYTES))
+    return lines, words, size, chars, bool(first_in_word), bool(last_in_word)
+
+
+def _screen_updates(previous, lines):
+    """Return ANSI sequences that turn a screen showing previous into lines, touching only changed rows"""
+    updates = []
+    for row, line in enumerate(lines):
+        if row >= len(previous) or previous[row] != line:
+            updates.append(f"\033[{row + 1};1H{line}\033[K")
+    for row in range(len(lines), len(previous)):
+        updates.append(f"\033[{row + 1};1H\033[K")
+    if updates:
+        # Park the cursor below the output
+        updates.append(f"\033[{len(lines) + 1};1H")
+    return "".join(updates)
+
+
+class FrecencyIndex:
+    """In-memory copy of the directory frecency table with a trigram index over paths"""
+
+    def __init__(self, rows):
+        self.entries = {}
+        self.grams = {}
+        self.total_rank = 0
+        for path, rank, last_access in rows:
+            self.add(path, rank, last_access)
+
+    def add(self, path, rank, last_access):
+        if path not in self.entries:
+            for gram in _trigrams(os.fsencode(path)):
+                self.grams.setdefault(gram, set()).add(path)
+        self.total_rank += rank - self.entries.get(path, [0])[0]
+        self.entries[path] = [rank, last_access]
+
+    def remove(self, path):
+        entry = self.entries.pop(path, None)
+        if entry is not None:
+            self.total_rank -= entry[0]
+            for gram in _trigrams(os.fsencode(path)):
+                self.grams[gram].discard(path)
+
+    @staticmethod
+    def score(rank, last_access, now):
+        """Weight visit count by recency, the way z does"""
+        age = now - last_access
+        if age < 3600:
+            return rank * 4
+        if age < 86400:
+            return rank * 2
+        if age < 604800:
+            return rank / 2
+        return rank / 4
+
+    def matches(self, terms, now):
+        """Return paths containing the terms in order, best first
+
+        Paths whose basename holds the last term win, then higher frecency.
+        """
+        terms = [term.lower() for term in terms]
+        candidates = None
+        for term in terms:
+            grams = _trigrams(os.fsencode(term))
+            for gram in grams:
+                paths = self.grams.get(gram, set())
+                candidates = set(paths) if candidates is None else candidates & paths
+        if candidates is None:
+            # Every term is shorter than a trigram
+            candidates = self.entries
+
+        results = []
+        for path in candidates:
+            lowered = path.lower()
+            position = 0
+            for term in terms:
+                position = lowered.find(term, position)
+                if position == -1:
+                    break
+                position += len(term)
+            else:
+                results.append(path)
+
+        def rank(path):
+            in_basename = bool(terms) and terms[-1] in os.path.basename(path.lower())
+            return in_basename, self.score(*self.entries[path], now)
+        return sorted(results, key=rank, reverse=True)
+
+
+class SessionRecorder:
+    """Append-only binary log of commands, their timings and outputs
+
+    The file starts with a magic string and the working directory the first
+    session started in. Each record is (wall time, duration, command length,
+    compressed output length) followed by the command and zlib-compressed output.
+    """
+
+    def __init__(self, path, cwd):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        if new_file:
+            encoded = os.fsencode(cwd)
+            self.file.write(SESSION_LOG_MAGIC + struct.pack('<I', len(encoded)) + encoded)
+        self.path = path
+        self.count = 0
+
+    def append(self, timestamp, duration, command, output):
+        command_bytes = command.encode('utf-8')
+        output_bytes = zlib.compress(output.encode('utf-8'))
+        self.file.write(SESSION_RECORD.pack(timestamp, duration, len(command_bytes), len(output_bytes)))
+        self.file.write(command_bytes)
+        self.file.write(output_bytes)
+        # Flush per record so a crashed session still leaves a usable log
+        self.file.flush()
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def _read_session_log(path):
+    """Return (cwd, [(timestamp, duration, command, output), ...]) from a session log"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(SESSION_LOG_MAGIC):
+        raise ValueError(f"not a session log: {path}")
+    offset = len(SESSION_LOG_MAGIC)
+    (cwd_length,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    cwd = os.fsdecode(data[offset:offset + cwd_length])
+    offset += cwd_length
+
+    records = []
+    while offset + SESSION_RECORD.size <= len(data):
+        timestamp, duration, command_length, output_length = SESSION_RECORD.unpack_from(data, offset)
+        offset += SESSION_RECORD.size
+        if offset + command_length + output_length > len(data):
+            # Partially written last record
+            break
+        command = data[offset:offset + command_length].decode('utf-8')
+        offset += command_length
+        output = zlib.decompress(data[offset:offset + output_length]).decode('utf-8')
+        offset += output_length
+        records.append((timestamp, duration, command, output))
+    return cwd, records
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@functools.lru_cache(maxsize=128)
+def _lexer_for(name, first_line):
+    """Pick a lexer by file name, falling back to guessing from the first line"""
+    options = {'stripnl': False, 'ensurenl': False}
+    try:
+        return get_lexer_for_filename(name, **options)
+    except ClassNotFound:
+        pass
+    try:
+        return guess_lexer(first_line, **options)
+    except ClassNotFound:
+        return TextLexer(**options)
+
+
+class ResumableLexing:
+    """Run a RegexLexer from a given state stack, keeping that stack readable
+
+    pygments copies the stack it is given and keeps the working copy private,
+    so this mirrors RegexLexer.get_tokens_unprocessed over the lexer's
+    compiled state table. While the tokens of a match are being consumed,
+    `stack` is the state the match started in and `match_start` its offset;
+    resuming from that stack at that offset reproduces the same tokens.
+    """
+
+    def __init__(self, lexer, text, stack=('root',)):
+        self.lexer = lexer
+        self.text = text
+        self.stack = list(stack)
+        self.match_start = 0
+
+    @staticmethod
+    def supports(lexer):
+        """Whether lexer uses the stock RegexLexer loop this class mirrors"""
+        return (type(lexer).get_tokens_unprocessed is RegexLexer.get_tokens_unprocessed
+                and isinstance(getattr(lexer, '_tokens', None), dict))
+
+    def __iter__(self):
+        text = self.text
+        tokendefs = self.lexer._tokens
+        statetokens = tokendefs[self.stack[-1]]
+        pos = 0
+        while True:
+            self.match_start = pos
+            for rexmatch, action, new_state in statetokens:
+                m = rexmatch(text, pos)
+                if not m:
+                    continue
+                if action is not None:
+                    if type(action) is type(Token):
+                        yield pos, action, m.group()
+                    else:
+                        yield from action(self.lexer, m)
+                pos = m.end()
+                if new_state is not None:
+                    self._transition(new_state)
+                    statetokens = tokendefs[self.stack[-1]]
+                break
+            else:
+                if pos >= len(text):
+                    return
+                if text[pos] == '\n':
+                    # At end of line an unmatched character resets the lexer to 'root'
+                    self.stack = ['root']
+                    statetokens = tokendefs['root']
+                    yield pos, Whitespace, '\n'
+                else:
+                    yield pos, ErrorToken, text[pos]
+                pos += 1
+
+    def _transition(self, new_state):
+        stack = self.stack
+        if isinstance(new_state, tuple):
+            for state in new_state:
+                if state == '#pop':
+                    if len(stack) > 1:
+                        stack.pop()
+                elif state == '#push':
+                    stack.append(stack[-1])
+                else:
+                    stack.append(state)
+        elif isinstance(new_state, int):
+            # Pop, but keep at least one state on the stack
+            if abs(new_state) >= len(stack):
+                del stack[1:]
+            else:
+                del stack[new_state:]
+        elif new_state == '#push':
+            stack.append(stack[-1])
+        else:
+            raise ValueError(f"wrong state def: {new_state!r}")
+
+
+class HighlightedFile:
+    """Highlights a file one viewport at a time, resuming the lexer from checkpoints
+
+    Line offsets are found lazily through mmap. For plain RegexLexer lexers the
+    state stack is saved every HIGHLIGHT_CHECKPOINT_LINES lines, so rendering a
+    page only lexes from the nearest checkpoint before it up to the page end.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fingerprint = _fingerprint(path)
+        with open(path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.line_starts = [0]
+        self.complete = self.size == 0
+        self.checkpoints = {0: ('root',)}
+
+        self.lexer = None
+        self.resumable = False
+        if pygments is not None:
+            name, ext = os.path.splitext(os.path.basename(path))
+            newline = self.data.find(b'\n', 0, 4096)
+            first_line = self.data[:newline if newline != -1 else 4096].decode('utf-8', errors='replace')
+            # Key by extension so every .py file shares one cached lexer lookup
+            self.lexer = _lexer_for(f"file{ext}" if ext else name, first_line)
+            self.formatter = TerminalFormatter()
+            self.resumable = ResumableLexing.supports(self.lexer)
+
+    def _index_lines(self, upto):
+        """Extend the line offset table until it reaches line upto or the end of the file"""
+        while not self.complete and len(self.line_starts) <= upto:
+            newline = self.data.find(b'\n', self.line_starts[-1])
+            if newline == -1 or newline + 1 == self.size:
+                self.complete = True
+                break
+            self.line_starts.append(newline + 1)
+
+    def line_count(self):
+        """Lines indexed so far (the total once the whole file has been indexed)"""
+        return len(self.line_starts) if self.size else 0
+
+    def render(self, start, count):
+        """Return lines [start, start + count) highlighted, lexing as little as possible"""
+        self._index_lines(start + count)
+        end = min(start + count, self.line_count())
+        if start >= end:
+            return []
+        end_byte = self.line_starts[end] if end < len(self.line_starts) else self.size
+
+        if self.lexer is None:
+            text = self.data[self.line_starts[start]:end_byte].decode('utf-8', errors='replace')
+            return text.split('\n')[:end - start]
+
+        first = 0
+        if self.resumable:
+            first = start // HIGHLIGHT_CHECKPOINT_LINES * HIGHLIGHT_CHECKPOINT_LINES
+            while first not in self.checkpoints:
+                first -= HIGHLIGHT_CHECKPOINT_LINES
+        text = self.data[self.line_starts[first]:end_byte].decode('utf-8', errors='replace')
+
+        # Character offset of every line start inside text
+        char_starts = [0]
+        for _ in range(first + 1, end):
+            char_starts.append(text.index('\n', char_starts[-1]) + 1)
+        view_start = char_starts[start - first]
+
+        if self.resumable:
+            lexing = ResumableLexing(self.lexer, text, self.checkpoints[first])
+        else:
+            lexing = None
+        tokens = lexing if lexing is not None else self.lexer.get_tokens_unprocessed(text)
+        next_checkpoint = first + HIGHLIGHT_CHECKPOINT_LINES
+
+        visible = []
+        for pos, token_type, value in tokens:
+            while next_checkpoint < end and pos >= char_starts[next_checkpoint - first]:
+                # A checkpoint is only exact when a match starts right at the line start
+                if lexing is not None and pos == char_starts[next_checkpoint - first] == lexing.match_start:
+                    self.checkpoints.setdefault(next_checkpoint, tuple(lexing.stack))
+                next_checkpoint += HIGHLIGHT_CHECKPOINT_LINES
+            if pos + len(value) <= view_start:
+                continue
+            if pos < view_start:
+                value = value[view_start - pos:]
+            visible.append((token_type, value))
+
+        return pygments.format(visible, self.formatter).split('\n')[:end - start]
+
+    def close(self):
+        if self.size:
+            self.data.close()
+
+
+def _fingerprint(path):
+    """Identify a file's current version by (dev, inode, mtime, size); None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class ResultCache:
+    """LRU cache of command outputs, bounded by the total size of the cached outputs"""
+
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        output = self.entries.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        size = len(output.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= len(self.entries.pop(key).encode('utf-8'))
+        self.entries[key] = output
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted.encode('utf-8'))
+            self.evictions += 1
+
+
+_worker_terminal = None
+
+
+def _run_builtin_job(job):
+    """Run one builtin command in a pool worker; returns (index, exit_code, output, seconds)"""
+    global _worker_terminal
+    index, current_dir, state_dir, command = job
+    if _worker_terminal is None:
+        _worker_terminal = SimpleTerminal()
+    _worker_terminal.current_dir = current_dir
+    _worker_terminal.state_dir = state_dir
+    started = time.perf_counter()
+    output = _worker_terminal.execute_command(command)
+    exit_code = _worker_terminal.last_status
+    return index, exit_code, str(output), time.perf_counter() - started
+
+
+def _run_limited(command, cwd, limits):
+    """Run a shell command under a wall-clock timeout and rlimits
+
+    limits holds 'timeout' (wall seconds), 'cpu' (CPU seconds) and 'memory'
+    (address space bytes); None means unlimited. Returns (exit_code, stdout,
+    stderr, rusage, timed_out); rusage is None where wait4 is unavailable.
+    """
+    timeout = limits.get('timeout')
+    if resource is None or not hasattr(os, 'wait4'):
+        try:
+            result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=cwd, timeout=timeout)
+            return result.returncode, result.stdout, result.stderr, None, False
+        except subprocess.TimeoutExpired as e:
+            return -9, e.stdout or "", e.stderr or "", None, True
+
+    cpu, memory = limits.get('cpu'), limits.get('memory')
+    # Apply rlimits with the shell's own ulimit before the command runs; a
+    # preexec_fn is unsafe while other threads (readers, decompressors) run
+    ulimits = []
+    if cpu:
+        ulimits.append(f"ulimit -t {max(1, int(cpu))}")
+    if memory:
+        ulimits.append(f"ulimit -v {max(1, int(memory) // 1024)}")
+    if ulimits:
+        command = " && ".join(ulimits) + " || exit 126\n" + command
+
+    proc = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
+                            start_new_session=True)
+    output = {}
+
+    def drain(name, stream):
+        output[name] = stream.read()
+        stream.close()
+
+    def kill_group():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    readers = [threading.Thread(target=drain, args=('stdout', proc.stdout), daemon=True),
+               threading.Thread(target=drain, args=('stderr', proc.stderr), daemon=True)]
+    for reader in readers:
+        reader.start()
+
+    timed_out = False
+    try:
+        deadline = time.monotonic() + timeout if timeout else None
+        if deadline is None:
+            _, status, usage = os.wait4(proc.pid, 0)
+        else:
+            # Poll the child itself rather than its pipes, which it may have closed
+            # or redirected; back off from 1ms so short commands return quickly
+            delay = 0.001
+            while True:
+                pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+                if pid:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    kill_group()
+                    # Reap the child ourselves so its resource usage can be reported
+                    _, status, usage = os.wait4(proc.pid, 0)
+                    break
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.02)
+        for reader in readers:
+            reader.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        if any(reader.is_alive() for reader in readers):
+            # Background jobs of the command still hold the pipes open
+            kill_group()
+            for reader in readers:
+                reader.join()
+    except KeyboardInterrupt:
+        kill_group()
+        raise
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    decode = lambda data: (data or b"").decode('utf-8', errors='replace')
+    return proc.returncode, decode(output.get('stdout')), decode(output.get('stderr')), usage, timed_out
+
+
+def _format_rusage(exit_code, usage, wall):
+    """Summarise a child's exit status and resource usage on one line"""
+    if exit_code < 0:
+        status = f"killed by {signal.Signals(-exit_code).name}"
+    else:
+        status = f"exit {exit_code}"
+    line = f"⏱️  {status} | wall {wall:.2f}s"
+    if usage is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        max_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        line += f" | user {usage.ru_utime:.2f}s | sys {usage.ru_stime:.2f}s | max RSS {_format_size(max_rss)}"
+    return line
+
+
+def _parse_size(text):
+    """Parse a byte count with an optional K/M/G/T suffix"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _parse_duration(text):
+    """Parse a duration in seconds with an optional s/m/h/d suffix, as coreutils timeout does"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def _run_external_job(job):
+    """Run one shell command; returns (index, exit_code, output, seconds)"""
+    index, current_dir, command, limits = job
+    started = time.perf_counter()
+    try:
+        exit_code, stdout, stderr, _, timed_out = _run_limited(command, current_dir, limits)
+        output = stdout + stderr
+        if timed_out:
+            output += f"Command timed out after {limits['timeout']:g}s"
+    except Exception as e:
+        exit_code, output = 127, f"Command failed: {str(e)}"
+    return index, exit_code, output, time.perf_counter() - started
+
+
+def _copy_file(src, dst, resume=False):
+    """Copy one file with its metadata, returning the number of bytes written"""
+    if os.path.islink(src):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.symlink(os.readlink(src), dst)
+        return 0
+
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        src_stat = os.fstat(src_fd)
+        size = src_stat.st_size
+        try:
+            dst_stat = os.stat(dst)
+        except FileNotFoundError:
+            dst_stat = None
+        if dst_stat is not None and (dst_stat.st_dev, dst_stat.st_ino) == (src_stat.st_dev, src_stat.st_ino):
+            # Opening dst with O_TRUNC would empty the source
+            raise shutil.SameFileError(f"{src} and {dst} are the same file")
+        start = 0
+        flags = os.O_WRONLY | os.O_CREAT
+        if resume and os.path.exists(dst) and os.path.getsize(dst) <= size:
+            # Pick up where an interrupted copy stopped
+            start = os.path.getsize(dst)
+        else:
+            flags |= os.O_TRUNC
+        dst_fd = os.open(dst, flags, 0o600)
+        try:
+            written = 0
+            for offset, length in _data_segments(src_fd, size):
+                if offset + length <= start:
+                    continue
+                if offset < start:
+                    length -= start - offset
+                    offset = start
+                _copy_range(src_fd, dst_fd, offset, length)
+                written += length
+            # Extend to full size so trailing holes stay holes
+            os.ftruncate(dst_fd, size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return written
+
+
 class SimpleTerminal:
     def __init__(self):
         self.current_dir = os.getcwd()
         self.running = True
         self.ascii_patterns = self._init_ascii_patterns()
+        self.state_dir = STATE_DIR
+        self._locate_index = None
+        self.structured_output = False
+        self._process_index_cache = {}
+        self.result_cache = None
+        self.command_limits = {'timeout': None, 'cpu': None, 'memory': None}
+        self.report_usage = False
+        self.last_usage = None
+        self.previous_dir = None
+        self.dir_stack = []
+        self._frecency = None
+        self.variables = {}
+        self.last_status = 0
+        self.recorder = None
+        self._highlighted_files = OrderedDict()
+        self._command_depth = 0
+        # Commands whose output depends only on their arguments, the working
+        # directory and the files returned here; None means don't cache this call
+        self.pure_commands = {
+            "pwd": lambda args: [],
+            "ls": lambda args: [self.current_dir],
+            "cat": lambda args: [os.path.join(self.current_dir, arg) for arg in args if not arg.startswith("-")],
+            "wc": lambda args: [os.path.join(self.current_dir, arg) for arg in args if not arg.startswith("-")],
+            "ascii": self._ascii_dependencies,
+        }
+        self.record_handlers = {
+            "pwd": self._working_directory_records,
+            "ls": self._directory_records,
+            "ps": self._process_records,
+            "sysinfo": self._system_records,
+            "locate": self._locate_records,
+            "pgrep": self._pgrep_records,
+            "iotop": self._io_top_records,
+            "nettop": self._net_top_records,
+            "parallel": self._parallel_records,
+        }
         
     def show_banner(self):
         """Display simple welcome message"""
@@ -30,13 +1418,216 @@ class SimpleTerminal:
 
     def execute_command(self, command):
         """Execute a command and return the result"""
-        parts = command.strip().split()
-        if not parts:
-            return ""
-        
-        cmd = parts[0].lower()
-        args = parts[1:] if len(parts) > 1 else []
+        recorder = self.recorder if self._command_depth == 0 else None
+        self._command_depth += 1
+        started_wall = time.time()
+        started = time.perf_counter()
+        try:
+            output = self._execute_line(command)
+        finally:
+            self._command_depth -= 1
+        self._record_command(recorder, started_wall, started, command, output)
+        return output
+
+    def _record_command(self, recorder, started_wall, started, command, output):
+        """Append a finished top-level command to the session recording, if one is running"""
+        # Only record commands issued while recording was already on,
+        # so 'record start' and 'record stop' stay out of the log
+        if recorder is not None and recorder is self.recorder and command.strip():
+            recorder.append(started_wall, time.perf_counter() - started, command, output)
+
+    def _execute_line(self, command):
+        """Parse a command line and run its commands, honouring ;, && and ||"""
+        try:
+            commands = parse_command_line(command)
+        except ValueError as e:
+            self.last_status = 2
+            return Failure(f"Parse error: {str(e)}")
         
+        outputs = []
+        for connector, node in commands:
+            if connector == "&&" and self.last_status != 0:
+                continue
+            if connector == "||" and self.last_status == 0:
+                continue
+            output = self._execute_simple(node)
+            if output:
+                outputs.append(output)
+        return "\n".join(outputs)
+
+    def _execute_simple(self, node):
+        """Expand and run one simple command, applying redirections for builtins"""
+        if node.shell:
+            # Pipelines, background jobs and command substitution belong to the system shell
+            return self._run_argv("", [], node.source)
+
+        try:
+            argv = [value for word in node.words for value in self._expand_word(word)]
+        except ValueError as e:
+            self.last_status = 1
+            return Failure(f"Error: {str(e)}")
+        assignments = []
+        while argv and re.match(r'^[A-Za-z_][A-Za-z0-9_]*=', argv[0]):
+            assignments.append(argv.pop(0))
+        if not argv:
+            for assignment in assignments:
+                name, value = assignment.split("=", 1)
+                self.variables[name] = value
+            self.last_status = 0
+            return ""
+
+        cmd = argv[0].lower()
+        args = argv[1:]
+        if cmd not in BUILTIN_COMMANDS or assignments:
+            # The shell applies its own redirections, globs and prefix assignments
+            return self._run_argv(cmd if cmd not in BUILTIN_COMMANDS else "", args, node.source)
+
+        redirect_output = None
+        for op, word in node.redirects:
+            target = os.path.join(self.current_dir, "".join(self._expand_word(word, glob=False)))
+            if op == "<":
+                self.last_status = 1
+                return Failure("Error: input redirection is not supported for builtins")
+            if op in ("2>", "2>>"):
+                # Builtins report errors in their output, so stderr stays empty
+                try:
+                    open(target, 'w' if op == "2>" else 'a').close()
+                except OSError as e:
+                    self.last_status = 1
+                    return Failure(f"Error: {str(e)}")
+            else:
+                redirect_output = (op, target)
+
+        # Builtins that run system commands set the status themselves
+        self.last_status = 0
+        output = self._run_argv(cmd, args, node.source)
+        if isinstance(output, Failure):
+            self.last_status = 1
+        if redirect_output is not None:
+            op, target = redirect_output
+            try:
+                with open(target, 'w' if op == ">" else 'a') as f:
+                    if output:
+                        f.write(output if output.endswith("\n") else output + "\n")
+            except OSError as e:
+                self.last_status = 1
+                return Failure(f"Error: {str(e)}")
+            return ""
+        return output
+
+    def _expand_word(self, word, glob=True):
+        """Expand ~, $VAR and globs in a parsed word; returns the resulting arguments"""
+        text = ""
+        pattern = ""
+        magic = False
+        for position, (kind, part) in enumerate(word):
+            if kind == "single":
+                text += part
+                pattern += "".join(f"[{ch}]" if ch in "*?[" else ch for ch in part)
+                continue
+            if kind == "plain" and position == 0 and (part == "~" or part.startswith("~/")):
+                part = os.path.expanduser("~") + part[1:]
+            part = VARIABLE_RE.sub(self._variable_value, part)
+            text += part
+            if kind == "plain":
+                pattern += part
+                magic = magic or _has_magic(part)
+            else:
+                pattern += "".join(f"[{ch}]" if ch in "*?[" else ch for ch in part)
+
+        if glob and magic:
+            matches = _expand_glob(pattern, self.current_dir)
+            if matches:
+                return matches
+        if not text and all(kind == "plain" for kind, _ in word):
+            # An unquoted word that expanded to nothing disappears
+            return []
+        return [text]
+
+    def _variable_value(self, match):
+        name = match.group(1) or match.group(2)
+        if name == "?":
+            return str(self.last_status)
+        return self.variables.get(name, os.environ.get(name, ""))
+
+    def _run_argv(self, cmd, args, command):
+        """Run an expanded command through the record, cache or plain dispatch path"""
+        if self._wants_records(cmd, args):
+            return "\n".join(self.stream_records(cmd, args, command))
+        if self.result_cache is not None and cmd in self.pure_commands:
+            return self._cached_dispatch(cmd, args, command)
+        return self._dispatch(cmd, args, command)
+
+    def record_stream(self, command):
+        """Return a generator of NDJSON lines if command is a single record-producing command, else None"""
+        try:
+            commands = parse_command_line(command)
+        except ValueError:
+            return None
+        if len(commands) != 1:
+            return None
+        node = commands[0][1]
+        if node.shell or node.redirects:
+            return None
+        argv = [value for word in node.words for value in self._expand_word(word)]
+        if not argv or not self._wants_records(argv[0].lower(), argv[1:]):
+            return None
+        # As in _execute_simple; only stream_records' error branches set a failure
+        self.last_status = 0
+        records = self.stream_records(argv[0].lower(), argv[1:], node.source)
+        if self.recorder is None:
+            return records
+        return self._recorded_stream(records, command)
+
+    def _recorded_stream(self, records, command):
+        """Pass streamed lines through, then record the command like execute_command does"""
+        recorder = self.recorder
+        started_wall = time.time()
+        started = time.perf_counter()
+        lines = []
+        for line in records:
+            lines.append(line)
+            yield line
+        self._record_command(recorder, started_wall, started, command, "\n".join(lines))
+
+    def _cached_dispatch(self, cmd, args, command):
+        """Serve a pure command from the result cache while its inputs are unchanged"""
+        dependencies = self.pure_commands[cmd](args)
+        if dependencies is None:
+            return self._dispatch(cmd, args, command)
+        key = (cmd, tuple(args), self.current_dir,
+               tuple(_fingerprint(path) for path in dependencies))
+        output = self.result_cache.get(key)
+        if output is None:
+            output = self._dispatch(cmd, args, command)
+            self.result_cache.put(key, output)
+        return output
+
+    def _wants_records(self, cmd, args):
+        """Check whether a command should produce NDJSON records instead of text"""
+        if cmd == "json":
+            return False
+        return self.structured_output or ("--json" in args and cmd in self.record_handlers)
+
+    def stream_records(self, cmd, args, command):
+        """Yield a command's result as NDJSON lines, one record at a time"""
+        args = [arg for arg in args if arg != "--json"]
+        handler = self.record_handlers.get(cmd)
+        try:
+            if handler:
+                for record in handler(args):
+                    yield json.dumps(record, ensure_ascii=False)
+            else:
+                output = self._dispatch(cmd, args, command)
+                if isinstance(output, Failure):
+                    self.last_status = 1
+                yield json.dumps({"command": cmd or command.split()[0], "output": output}, ensure_ascii=False)
+        except Exception as e:
+            self.last_status = 1
+            yield json.dumps({"command": cmd or command.split()[0], "error": str(e)})
+
+    def _dispatch(self, cmd, args, command):
+        """Run a builtin or system command and return its text output"""
         try:
             if cmd == "help":
                 return self.show_help()
@@ -55,6 +1646,64 @@ class SimpleTerminal:
                 return self.remove_file(args)
             elif cmd == "cat":
                 return self.cat_file(args)
+            elif cmd == "less":
+                return self.page_file(args)
+            elif cmd == "cp":
+                return self.copy_path(args)
+            elif cmd == "mv":
+                return self.move_path(args)
+            elif cmd == "hash":
+                return self.hash_files(args)
+            elif cmd == "du":
+                return self.disk_usage(args)
+            elif cmd == "updatedb":
+                return self.update_locate_db(args)
+            elif cmd == "locate":
+                return self.locate(args)
+            elif cmd == "watch":
+                return self.watch_command(args)
+            elif cmd == "wc":
+                return self.word_count(args)
+            elif cmd == "grep":
+                return self.grep(args)
+            elif cmd == "sort":
+                return self.sort_lines(args)
+            elif cmd == "uniq":
+                return self.unique_lines(args)
+            elif cmd == "json":
+                return self.set_structured_output(args)
+            elif cmd == "pgrep":
+                return self.pgrep(args)
+            elif cmd == "pkill":
+                return self.pkill(args)
+            elif cmd == "cache":
+                return self.configure_result_cache(args)
+            elif cmd == "iotop":
+                return self.io_top(args)
+            elif cmd == "nettop":
+                return self.net_top(args)
+            elif cmd == "parallel":
+                return self.run_parallel(args)
+            elif cmd == "pushd":
+                return self.push_directory(args)
+            elif cmd == "popd":
+                return self.pop_directory(args)
+            elif cmd == "dirs":
+                return self.show_directory_stack()
+            elif cmd == "z":
+                return self.jump_directory(args)
+            elif cmd == "ulimit":
+                return self.configure_limits(args)
+            elif cmd == "timeout":
+                return self.run_with_timeout(args)
+            elif cmd == "record":
+                return self.record_session(args)
+            elif cmd == "replay":
+                return self.replay_session(args)
+            elif cmd == "export":
+                return self.export_variables(args)
+            elif cmd == "unset":
+                return self.unset_variables(args)
             elif cmd == "echo":
                 return " ".join(args)
             elif cmd == "clear":
@@ -70,7 +1719,7 @@ class SimpleTerminal:
                 # Try to execute as system command
                 return self.execute_system_command(command)
         except Exception as e:
-            return f"Error: {str(e)}"
+            return Failure(f"Error: {str(e)}")
 
     def show_help(self):
         """Show available commands"""
@@ -80,11 +1729,38 @@ Available Commands:
   exit/quit     - Exit the terminal
   pwd           - Print working directory
   ls            - List directory contents
-  cd <dir>      - Change directory
+  cd <dir>      - Change directory (cd - for previous, ~ for home)
+  pushd/popd/dirs - Directory stack
+  z <terms>     - Jump to the most frecent directory matching terms (-l to list)
   mkdir <name>  - Create directory
   rm <file>     - Remove file
-  cat <file>    - Display file contents
+  cat <file>    - Display file contents (--color to highlight)
+  less <file> [+N] - Page through a file with syntax highlighting
+  cp <src> <dst> - Copy files or trees (-r, -j N, --resume)
+  mv <src> <dst> - Move or rename files and directories
+  hash <paths>  - Hash files or trees (-a md5|sha1|sha256|blake2b, -j N)
+  du [-n N] [dir] - Show the largest subdirectories
+  updatedb [roots] - Build or refresh the filename index
+  locate <text> - Find indexed paths (-i ignore case, -r regex, -l N limit)
+  watch -n <secs> <cmd> - Re-run a command, redrawing only changed lines
+  wc <files>    - Count lines, words and bytes (-l -w -c -m)
+  grep <regex> <files> - Search files for a pattern (-i -v -n -c)
+  sort <files>  - Sort lines (-k N[,M] -n -r -u -S budget -o out), spilling to disk
+  uniq [-c] <file> - Collapse adjacent duplicate lines, optionally counting them
+  json on|off   - Emit every result as NDJSON records
+  pgrep <regex> - Find processes (-f cmdline, -u user, -x exact, -i, -l)
+  pkill <regex> - Signal matching processes (-SIGNAL, -t grace secs)
+  cache on|off|stats|clear - Memoize pwd, ls, cat, wc and ascii outputs
+  iotop         - Rank processes by disk read/write rate (-i secs, -n N)
+  nettop        - Rank processes by open network connections (-i secs, -n N)
+  parallel [-j N] [-k] <cmd {}> ::: <args> - Run a command per argument across a pool
+  ulimit        - Limits for system commands (-w wall secs, -t cpu secs, -v memory, -r on|off)
+  timeout <secs>[smhd] <cmd> - Run a system command with a wall-clock timeout
+  <cmd> --json  - NDJSON records for pwd, ls, ps, sysinfo, locate, pgrep, iotop, nettop, parallel
   echo <text>   - Print text
+  record start <file> | stop - Record commands, timings and outputs
+  replay <file> [--max] [-c N] - Replay a recording and report latency and divergence
+  export NAME=value / unset NAME - Set or clear variables ($NAME in commands)
   clear         - Clear screen
   sysinfo       - Show system information
   ps            - List running processes
@@ -93,47 +1769,226 @@ Available Commands:
         """
         return help_text
 
+    def export_variables(self, args):
+        """Set variables and export them to system commands; no args lists them"""
+        if not args:
+            return "\n".join(f"{name}={value}" for name, value in sorted(self.variables.items()))
+        for arg in args:
+            name, has_value, value = arg.partition("=")
+            if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name):
+                return Failure(f"Invalid variable name: {name}")
+            if has_value:
+                self.variables[name] = value
+            os.environ[name] = self.variables.get(name, os.environ.get(name, ""))
+        return ""
+
+    def unset_variables(self, args):
+        """Remove variables from the session and the exported environment"""
+        if not args:
+            return Failure("Usage: unset <name>...")
+        for name in args:
+            self.variables.pop(name, None)
+            os.environ.pop(name, None)
+        return ""
+
+    def set_structured_output(self, args):
+        """Toggle session-wide NDJSON output"""
+        if not args or args[0] not in ("on", "off"):
+            return Failure(f"Usage: json on|off (currently {'on' if self.structured_output else 'off'})")
+        self.structured_output = args[0] == "on"
+        return f"Structured output {args[0]}"
+
+    def configure_result_cache(self, args):
+        """Enable, disable, inspect or clear the result cache for pure commands"""
+        action = args[0] if args else "stats"
+        if action == "on":
+            max_bytes = int(args[1]) if len(args) > 1 else RESULT_CACHE_BYTES
+            self.result_cache = ResultCache(max_bytes)
+            return f"Result cache on ({_format_size(max_bytes)} budget)"
+        if action == "off":
+            self.result_cache = None
+            return "Result cache off"
+        if action == "clear":
+            if self.result_cache is not None:
+                self.result_cache = ResultCache(self.result_cache.max_bytes)
+            return "Result cache cleared"
+        if action == "stats":
+            cache = self.result_cache
+            if cache is None:
+                return "Result cache is off (use 'cache on [max_bytes]')"
+            return (f"🗃️  Result cache: {len(cache.entries)} entries, "
+                    f"{_format_size(cache.total_bytes)} / {_format_size(cache.max_bytes)}, "
+                    f"{cache.hits} hits, {cache.misses} misses, {cache.evictions} evictions")
+        return Failure("Usage: cache on [max_bytes] | off | stats | clear")
+
+    def _working_directory_records(self, args):
+        """Yield the working directory as a record"""
+        yield {"path": self.current_dir}
+
+    def _directory_records(self, args):
+        """Yield one record per directory entry: name, type and size"""
+        with os.scandir(self.current_dir) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        for entry in entries:
+            try:
+                if entry.is_symlink():
+                    kind = "symlink"
+                elif entry.is_dir():
+                    kind = "dir"
+                else:
+                    kind = "file"
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                kind, size = "unknown", None
+            yield {"name": entry.name, "type": kind, "size": size}
+
     def list_directory(self):
         """List directory contents"""
         try:
-            items = os.listdir(self.current_dir)
-            if not items:
-                return "Directory is empty"
-            
             result = []
-            for item in sorted(items):
-                item_path = os.path.join(self.current_dir, item)
-                if os.path.isdir(item_path):
-                    result.append(f"📁 {item}/")
+            for record in self._directory_records([]):
+                if record["type"] == "dir" or (record["type"] == "symlink" and
+                                               os.path.isdir(os.path.join(self.current_dir, record["name"]))):
+                    result.append(f"📁 {record['name']}/")
                 else:
-                    result.append(f"📄 {item}")
+                    result.append(f"📄 {record['name']}")
+            if not result:
+                return "Directory is empty"
             return "\n".join(result)
         except PermissionError:
-            return "Permission denied"
+            return Failure("Permission denied")
+
+    def _resolve_directory(self, target):
+        """Return the absolute path for target if it is a directory, using a single stat"""
+        path = os.path.normpath(os.path.join(self.current_dir, os.path.expanduser(target)))
+        try:
+            return path if stat.S_ISDIR(os.stat(path).st_mode) else None
+        except OSError:
+            return None
+
+    def _enter_directory(self, new_dir):
+        """Switch to new_dir, remembering the previous directory and recording the visit"""
+        if new_dir != self.current_dir:
+            self.previous_dir = self.current_dir
+        self.current_dir = new_dir
+        try:
+            self._record_visit(new_dir)
+        except Exception:
+            # A broken frecency database must never stop cd from working
+            pass
 
     def change_directory(self, args):
         """Change directory"""
         if not args:
-            return "Usage: cd <directory>"
+            return Failure("Usage: cd <directory>")
         
         target = args[0]
-        if target == "..":
-            new_dir = os.path.dirname(self.current_dir)
-        elif target.startswith("/"):
-            new_dir = target
-        else:
-            new_dir = os.path.join(self.current_dir, target)
+        if target == "-":
+            if self.previous_dir is None:
+                return Failure("No previous directory")
+            target = self.previous_dir
         
-        if os.path.exists(new_dir) and os.path.isdir(new_dir):
-            self.current_dir = os.path.abspath(new_dir)
-            return f"Changed to: {self.current_dir}"
+        new_dir = self._resolve_directory(target)
+        if new_dir is None:
+            return Failure(f"Directory not found: {args[0]}")
+        self._enter_directory(new_dir)
+        return f"Changed to: {self.current_dir}"
+
+    def push_directory(self, args):
+        """Push the current directory and change to a new one (no args swaps the top two)"""
+        if args:
+            new_dir = self._resolve_directory(args[0])
+            if new_dir is None:
+                return Failure(f"Directory not found: {args[0]}")
+        elif self.dir_stack:
+            new_dir = self.dir_stack.pop()
         else:
-            return f"Directory not found: {target}"
+            return Failure("pushd: no other directory")
+        self.dir_stack.append(self.current_dir)
+        self._enter_directory(new_dir)
+        return self.show_directory_stack()
+
+    def pop_directory(self, args):
+        """Return to the directory on top of the stack"""
+        if not self.dir_stack:
+            return Failure("popd: directory stack empty")
+        self._enter_directory(self.dir_stack.pop())
+        return self.show_directory_stack()
+
+    def show_directory_stack(self):
+        """Show the current directory followed by the stack, most recent first"""
+        home = os.path.expanduser("~")
+        shorten = lambda path: "~" + path[len(home):] if path == home or path.startswith(home + os.sep) else path
+        return " ".join(shorten(path) for path in [self.current_dir] + self.dir_stack[::-1])
+
+    def _frecency_index(self):
+        """Load the frecency table into memory once per session"""
+        if self._frecency is None:
+            db = self._open_state_db('frecency.db')
+            try:
+                db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY, rank REAL, last_access INTEGER)""")
+                self._frecency = FrecencyIndex(db.execute("SELECT path, rank, last_access FROM dirs"))
+            finally:
+                db.close()
+        return self._frecency
+
+    def _record_visit(self, path):
+        """Bump a directory's rank, aging every rank once the total grows too large"""
+        index = self._frecency_index()
+        now = int(time.time())
+        rank = index.entries.get(path, [0, now])[0] + 1
+        index.add(path, rank, now)
+        db = self._open_state_db('frecency.db')
+        try:
+            db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (path, rank, now))
+            if index.total_rank > FRECENCY_MAX_RANK:
+                db.execute("UPDATE dirs SET rank = rank * 0.99")
+                db.execute("DELETE FROM dirs WHERE rank < 1")
+                self._frecency = FrecencyIndex(db.execute("SELECT path, rank, last_access FROM dirs"))
+            db.commit()
+        finally:
+            db.close()
+
+    def jump_directory(self, args):
+        """Jump to the highest-frecency remembered directory matching all terms"""
+        list_only = "-l" in args
+        terms = [arg for arg in args if arg != "-l"]
+        try:
+            index = self._frecency_index()
+        except Exception as e:
+            return Failure(f"Error opening frecency database: {str(e)}")
+
+        now = int(time.time())
+        matches = index.matches(terms, now)
+        if list_only or not terms:
+            if not matches:
+                return Failure("No remembered directories match")
+            return "\n".join(f"{index.score(*index.entries[path], now):>10.1f}  {path}" for path in matches[:10])
+
+        gone = []
+        try:
+            for path in matches:
+                if self._resolve_directory(path) is None:
+                    gone.append(path)
+                    continue
+                self._enter_directory(path)
+                return f"Changed to: {self.current_dir}"
+            return Failure(f"No remembered directory matches: {' '.join(terms)}")
+        finally:
+            if gone:
+                # Forget directories that have been removed
+                for path in gone:
+                    index.remove(path)
+                db = self._open_state_db('frecency.db')
+                db.executemany("DELETE FROM dirs WHERE path = ?", [(path,) for path in gone])
+                db.commit()
+                db.close()
 
     def make_directory(self, args):
         """Create directory"""
         if not args:
-            return "Usage: mkdir <directory_name>"
+            return Failure("Usage: mkdir <directory_name>")
         
         dir_name = args[0]
         dir_path = os.path.join(self.current_dir, dir_name)
@@ -142,12 +1997,12 @@ Available Commands:
             os.makedirs(dir_path, exist_ok=True)
             return f"Created directory: {dir_name}"
         except Exception as e:
-            return f"Failed to create directory: {str(e)}"
+            return Failure(f"Failed to create directory: {str(e)}")
 
     def remove_file(self, args):
         """Remove file or directory"""
         if not args:
-            return "Usage: rm <file_or_directory>"
+            return Failure("Usage: rm <file_or_directory>")
         
         target = args[0]
         target_path = os.path.join(self.current_dir, target)
@@ -160,69 +2015,1417 @@ Available Commands:
                 os.remove(target_path)
                 return f"Removed file: {target}"
         except Exception as e:
-            return f"Failed to remove: {str(e)}"
+            return Failure(f"Failed to remove: {str(e)}")
 
     def cat_file(self, args):
         """Display file contents"""
+        color = "--color" in args or "-C" in args
+        args = [arg for arg in args if arg not in ("--color", "-C")]
         if not args:
-            return "Usage: cat <file>"
+            return Failure("Usage: cat [--color] <file>")
         
         file_path = os.path.join(self.current_dir, args[0])
         
         try:
-            with open(file_path, 'r') as f:
-                return f.read()
+            if color and _compression_opener(file_path) is None:
+                highlighted = self._highlighted_file(file_path)
+                lines = []
+                while True:
+                    page = highlighted.render(len(lines), 1000)
+                    if not page:
+                        break
+                    lines.extend(page)
+                return "\n".join(lines)
+            return _read_text(file_path)
+        except FileNotFoundError:
+            return Failure(f"File not found: {args[0]}")
+        except Exception as e:
+            return Failure(f"Error reading file: {str(e)}")
+
+    def _highlighted_file(self, path):
+        """Return a HighlightedFile for path, reusing its checkpoints while the file is unchanged"""
+        highlighted = self._highlighted_files.pop(path, None)
+        if highlighted is not None and highlighted.fingerprint != _fingerprint(path):
+            highlighted.close()
+            highlighted = None
+        if highlighted is None:
+            highlighted = HighlightedFile(path)
+        self._highlighted_files[path] = highlighted
+        while len(self._highlighted_files) > HIGHLIGHT_CACHE_FILES:
+            _, evicted = self._highlighted_files.popitem(last=False)
+            evicted.close()
+        return highlighted
+
+    def page_file(self, args):
+        """Page through a file, highlighting only the lines on screen"""
+        files = [arg for arg in args if not arg.startswith("+")]
+        if len(files) != 1:
+            return Failure("Usage: less <file> [+line]")
+        start = 0
+        for arg in args:
+            if arg.startswith("+") and arg[1:].isdigit():
+                start = max(0, int(arg[1:]) - 1)
+
+        try:
+            highlighted = self._highlighted_file(os.path.join(self.current_dir, files[0]))
         except FileNotFoundError:
-            return f"File not found: {args[0]}"
+            return Failure(f"File not found: {files[0]}")
+        except Exception as e:
+            return Failure(f"Error reading file: {str(e)}")
+
+        height = max(1, shutil.get_terminal_size().lines - 2)
+        if not sys.stdin.isatty():
+            # Nothing to page with; show one screen
+            return "\n".join(highlighted.render(start, height))
+
+        while True:
+            print("\n".join(highlighted.render(start, height)))
+            known = highlighted.line_count()
+            status = f"lines {start + 1}-{min(start + height, known)}" + ("" if highlighted.complete else "+")
+            try:
+                key = input(f"-- {files[0]} {status} -- [Enter] next, b back, <N> goto line, q quit: ").strip()
+            except EOFError:
+                break
+            if key == "q":
+                break
+            elif key == "b":
+                start = max(0, start - height)
+            elif key.isdigit():
+                start = max(0, int(key) - 1)
+            elif start + height < known or not highlighted.complete:
+                start += height
+        return ""
+
+    def copy_path(self, args):
+        """Copy a file or directory tree"""
+        recursive = False
+        resume = False
+        jobs = min(32, (os.cpu_count() or 1) + 4)
+        paths = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ("-r", "-R", "-a"):
+                recursive = True
+            elif arg == "-p":
+                # Metadata is always preserved
+                pass
+            elif arg == "--resume":
+                resume = True
+            elif arg == "-j" and i + 1 < len(args):
+                i += 1
+                jobs = max(1, int(args[i]))
+            elif arg.startswith("-") and len(arg) > 1:
+                return self._system_fallback("cp", args)
+            else:
+                paths.append(arg)
+            i += 1
+
+        if len(paths) != 2:
+            return Failure("Usage: cp [-r] [-j N] [--resume] <source> <destination>")
+
+        src = os.path.join(self.current_dir, paths[0])
+        dst = os.path.join(self.current_dir, paths[1])
+        if not os.path.lexists(src):
+            return Failure(f"File not found: {paths[0]}")
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return Failure(f"cp: {paths[0]} and {paths[1]} are the same file")
+
+        try:
+            if os.path.isdir(src) and not os.path.islink(src):
+                if not recursive:
+                    return Failure(f"cp: {paths[0]} is a directory (use -r)")
+                real_src = os.path.realpath(src)
+                if os.path.commonpath([real_src, os.path.realpath(dst)]) == real_src:
+                    return Failure(f"cp: cannot copy a directory, {paths[0]}, into itself, {paths[1]}")
+                files, total = self._copy_tree(src, dst, jobs, resume)
+            else:
+                files, total = 1, _copy_file(src, dst, resume)
+            return f"Copied {files} file(s), {_format_size(total)} to {paths[1]}"
+        except Exception as e:
+            return Failure(f"Failed to copy: {str(e)}")
+
+    def _copy_tree(self, src, dst, jobs, resume):
+        """Copy a directory tree, spreading file copies across a thread pool"""
+        pairs = []
+        dirs = []
+        # List the whole tree before creating anything, so new directories are never walked
+        for root, dirnames, filenames in os.walk(src):
+            target_root = os.path.join(dst, os.path.relpath(root, src))
+            dirs.append((root, target_root))
+            for name in filenames:
+                pairs.append((os.path.join(root, name), os.path.join(target_root, name)))
+            for name in list(dirnames):
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    # Recreate directory symlinks instead of descending into them
+                    dirnames.remove(name)
+                    pairs.append((path, os.path.join(target_root, name)))
+        for _, target_root in dirs:
+            os.makedirs(target_root, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            total = sum(pool.map(lambda pair: _copy_file(pair[0], pair[1], resume), pairs))
+
+        # Directory times change as files land in them, so restore them last
+        for root, target_root in reversed(dirs):
+            shutil.copystat(root, target_root)
+        return len(pairs), total
+
+    def move_path(self, args):
+        """Move or rename a file or directory"""
+        if len(args) != 2:
+            return Failure("Usage: mv <source> <destination>")
+
+        src = os.path.join(self.current_dir, args[0])
+        dst = os.path.join(self.current_dir, args[1])
+        if not os.path.lexists(src):
+            return Failure(f"File not found: {args[0]}")
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                return Failure(f"Failed to move: {str(e)}")
+            # Different filesystem: copy, then remove the original
+            try:
+                if os.path.isdir(src) and not os.path.islink(src):
+                    self._copy_tree(src, dst, min(32, (os.cpu_count() or 1) + 4), False)
+                    shutil.rmtree(src)
+                else:
+                    _copy_file(src, dst)
+                    os.remove(src)
+            except Exception as e:
+                return Failure(f"Failed to move: {str(e)}")
+        return f"Moved {args[0]} -> {args[1]}"
+
+    def _open_state_db(self, name):
+        """Open (creating if needed) a sqlite database in the state directory"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        return sqlite3.connect(os.path.join(self.state_dir, name))
+
+    def hash_files(self, args):
+        """Hash files or directory trees, reusing cached digests for unchanged files"""
+        algorithm = 'sha256'
+        jobs = os.cpu_count() or 1
+        use_cache = True
+        targets = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-a" and i + 1 < len(args):
+                i += 1
+                algorithm = args[i].lower()
+            elif arg == "-j" and i + 1 < len(args):
+                i += 1
+                jobs = max(1, int(args[i]))
+            elif arg == "--no-cache":
+                use_cache = False
+            else:
+                targets.append(arg)
+            i += 1
+
+        if not targets:
+            return Failure("Usage: hash [-a md5|sha1|sha256|blake2b] [-j N] [--no-cache] <file_or_directory>...")
+        if algorithm not in HASH_ALGORITHMS:
+            return Failure(f"Unsupported algorithm: {algorithm} (choose from {', '.join(HASH_ALGORITHMS)})")
+
+        files = []
+        for target in targets:
+            path = os.path.join(self.current_dir, target)
+            if os.path.isdir(path):
+                for root, _, filenames in os.walk(path):
+                    for name in sorted(filenames):
+                        files.append(os.path.join(root, name))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                return Failure(f"File not found: {target}")
+
+        try:
+            db = self._open_state_db('hash_cache.db')
+            db.execute("""CREATE TABLE IF NOT EXISTS hashes (
+                algorithm TEXT, dev INTEGER, ino INTEGER, size INTEGER,
+                mtime_ns INTEGER, digest TEXT, PRIMARY KEY (algorithm, dev, ino))""")
+        except Exception as e:
+            return Failure(f"Error opening hash cache: {str(e)}")
+
+        try:
+            digests = {}
+            keys = {}
+            pending = []
+            skipped = {}
+            for path in files:
+                try:
+                    st = os.stat(path)
+                except OSError as e:
+                    skipped[path] = e.strerror or str(e)
+                    continue
+                keys[path] = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+                if use_cache:
+                    row = db.execute(
+                        "SELECT size, mtime_ns, digest FROM hashes WHERE algorithm=? AND dev=? AND ino=?",
+                        (algorithm, st.st_dev, st.st_ino)).fetchone()
+                    if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+                        digests[path] = row[2]
+                        continue
+                pending.append(path)
+
+            work = [(path, algorithm) for path in pending]
+            if len(work) > 1 and jobs > 1:
+                with ProcessPoolExecutor(max_workers=min(jobs, len(work))) as pool:
+                    results = list(pool.map(_try_hash_file, work, chunksize=max(1, len(work) // (jobs * 4))))
+            else:
+                results = [_try_hash_file(job) for job in work]
+
+            for path, (digest, error) in zip(pending, results):
+                if error is not None:
+                    skipped[path] = error
+                    continue
+                digests[path] = digest
+                dev, ino, size, mtime_ns = keys[path]
+                db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                           (algorithm, dev, ino, size, mtime_ns, digest))
+            db.commit()
+        except Exception as e:
+            return Failure(f"Error hashing files: {str(e)}")
+        finally:
+            db.close()
+
+        result = []
+        for path in files:
+            name = os.path.relpath(path, self.current_dir)
+            if path in skipped:
+                result.append(f"❌ {name}: {skipped[path]}")
+            else:
+                result.append(f"{digests[path]}  {name}")
+        cached = len(files) - len(pending) - sum(1 for path in skipped if path not in pending)
+        result.append(f"#️⃣  {len(digests)} file(s) hashed with {algorithm}, {cached} from cache")
+        if skipped:
+            return Failure("\n".join(result))
+        return "\n".join(result)
+
+    def disk_usage(self, args):
+        """Show disk usage of the largest subdirectories, re-listing only changed directories"""
+        top_n = 10
+        use_cache = True
+        targets = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-n" and i + 1 < len(args):
+                i += 1
+                top_n = max(1, int(args[i]))
+            elif arg == "--no-cache":
+                use_cache = False
+            elif arg.startswith("-") and len(arg) > 1:
+                return self._system_fallback("du", args)
+            else:
+                targets.append(arg)
+            i += 1
+
+        if len(targets) > 1:
+            return Failure("Usage: du [-n N] [--no-cache] [directory]")
+        root = os.path.abspath(os.path.join(self.current_dir, targets[0] if targets else "."))
+        if not os.path.isdir(root):
+            return Failure(f"Directory not found: {targets[0]}")
+
+        try:
+            db = self._open_state_db('du_cache.db')
+            db.execute("""CREATE TABLE IF NOT EXISTS listings (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, files TEXT, subdirs TEXT)""")
         except Exception as e:
-            return f"Error reading file: {str(e)}"
+            return Failure(f"Error opening du cache: {str(e)}")
+
+        try:
+            # Load the cached subtree under root in one query
+            cached = {}
+            if use_cache:
+                rows = db.execute(
+                    "SELECT path, mtime_ns, files, subdirs FROM listings WHERE path = ? OR (path >= ? AND path < ?)",
+                    _subtree_range(root))
+                for path, mtime_ns, files, subdirs in rows:
+                    cached[path] = (mtime_ns, files.split('\0') if files else [], subdirs.split('\0') if subdirs else [])
+
+            tree, rescanned = _walk_cached(root, cached, _list_entries, (0, [], []))
+
+            # Deleted directories leave stale rows behind; drop them with the rewrite
+            stale = [(path,) for path in cached if path not in tree]
+            db.executemany("DELETE FROM listings WHERE path = ?", stale)
+            db.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                           [(path, tree[path][0], '\0'.join(tree[path][1]), '\0'.join(tree[path][2]))
+                            for path in rescanned])
+            db.commit()
+
+            # Only the listings are cached: a file growing in place leaves its directory's
+            # mtime alone, so every file is stat-ed again on each run
+            with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+                sizes = dict(zip(tree, pool.map(lambda path: _files_size(path, tree[path][1]), tree)))
+        except Exception as e:
+            return Failure(f"Error computing disk usage: {str(e)}")
+        finally:
+            db.close()
+
+        totals = {}
+        for path in sorted(tree, key=lambda p: p.count(os.sep), reverse=True):
+            totals[path] = sizes[path] + sum(totals.get(child, 0) for child in tree[path][2])
+
+        largest = sorted((p for p in totals if p != root), key=totals.get, reverse=True)[:top_n]
+        result = [f"{_format_size(totals[p]):>10}  {os.path.relpath(p, root)}/" for p in largest]
+        result.append(f"💾 Total: {_format_size(totals[root])} in {len(tree)} directories "
+                      f"({len(rescanned)} rescanned)")
+        return "\n".join(result)
+
+    def update_locate_db(self, args):
+        """Refresh the locate index, rescanning only directories whose mtime changed"""
+        started = time.perf_counter()
+        try:
+            db = self._open_state_db('locate_dirs.db')
+            db.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, files TEXT, subdirs TEXT)""")
+            db.execute("CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY)")
+        except Exception as e:
+            return Failure(f"Error opening locate database: {str(e)}")
+
+        try:
+            if args:
+                roots = [os.path.abspath(os.path.join(self.current_dir, arg)) for arg in args]
+                missing = [arg for arg, root in zip(args, roots) if not os.path.isdir(root)]
+                if missing:
+                    return Failure(f"Directory not found: {missing[0]}")
+                db.execute("DELETE FROM roots")
+                db.executemany("INSERT INTO roots VALUES (?)", [(root,) for root in roots])
+            else:
+                roots = [row[0] for row in db.execute("SELECT path FROM roots")] or [self.current_dir]
+
+            paths = []
+            rescanned_total = 0
+            for root in roots:
+                cached = {}
+                rows = db.execute(
+                    "SELECT path, mtime_ns, files, subdirs FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                    _subtree_range(root))
+                for path, mtime_ns, files, subdirs in rows:
+                    cached[path] = (mtime_ns, files.split('\0') if files else [],
+                                    subdirs.split('\0') if subdirs else [])
+
+                tree, rescanned = _walk_cached(root, cached, _list_entries, (0, [], []))
+                rescanned_total += len(rescanned)
+                db.executemany("DELETE FROM dirs WHERE path = ?", [(p,) for p in cached if p not in tree])
+                db.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                               [(p, tree[p][0], '\0'.join(tree[p][1]), '\0'.join(tree[p][2]))
+                                for p in rescanned])
+
+                for directory in sorted(tree):
+                    paths.append(directory)
+                    paths.extend(os.path.join(directory, name) for name in sorted(tree[directory][1]))
+            db.commit()
+
+            _write_locate_index(os.path.join(self.state_dir, 'locate.idx'), paths)
+        except Exception as e:
+            return Failure(f"Error updating locate index: {str(e)}")
+        finally:
+            db.close()
+
+        elapsed = time.perf_counter() - started
+        return (f"🗂️  Indexed {len(paths)} paths under {len(roots)} root(s) "
+                f"({rescanned_total} directories rescanned) in {elapsed:.2f}s")
+
+    def _parse_locate_args(self, args):
+        """Parse locate flags into (pattern, ignore_case, regex, limit)"""
+        ignore_case = False
+        regex = False
+        limit = None
+        usage = "Usage: locate [-i] [-r] [-l N] <substring_or_regex>"
+        patterns = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-i":
+                ignore_case = True
+            elif arg == "-r":
+                regex = True
+            elif arg == "-l" and i + 1 < len(args):
+                i += 1
+                try:
+                    limit = max(1, int(args[i]))
+                except ValueError:
+                    raise ValueError(usage) from None
+            else:
+                patterns.append(arg)
+            i += 1
+
+        if len(patterns) != 1:
+            raise ValueError(usage)
+        return patterns[0], ignore_case, regex, limit
+
+    def _locate_records(self, args):
+        """Yield one record per indexed path matching the locate query"""
+        pattern, ignore_case, regex, limit = self._parse_locate_args(args)
+
+        index_path = os.path.join(self.state_dir, 'locate.idx')
+        if not os.path.exists(index_path):
+            raise FileNotFoundError("No locate index found. Run 'updatedb' first.")
+
+        index = self._locate_index
+        if index is None or index.mtime_ns != os.stat(index_path).st_mtime_ns:
+            # updatedb replaced the file; map the new one
+            if index is not None:
+                index.close()
+            index = self._locate_index = LocateIndex(index_path)
+
+        if regex:
+            compiled = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+            matches = compiled.search
+        elif ignore_case:
+            needle = pattern.lower()
+            matches = lambda path: needle in path.lower()
+        else:
+            matches = lambda path: pattern in path
+
+        ids = index.candidates(_required_literals(pattern, regex))
+        if ids is None:
+            ids = range(index.n_paths)
+
+        found = 0
+        for path_id in ids:
+            path = index.get_path(path_id)
+            if matches(path):
+                yield {"path": path}
+                found += 1
+                if limit and found >= limit:
+                    break
+
+    def locate(self, args):
+        """Find paths in the locate index by substring or regex"""
+        try:
+            pattern = self._parse_locate_args(args)[0]
+            result = [record["path"] for record in self._locate_records(args)]
+        except (ValueError, FileNotFoundError) as e:
+            return Failure(str(e))
+        except re.error as e:
+            return Failure(f"Invalid regex: {str(e)}")
+        except Exception as e:
+            return Failure(f"Error searching locate index: {str(e)}")
+
+        return "\n".join(result) if result else Failure(f"No matches for: {pattern}")
+
+    def watch_command(self, args):
+        """Re-run a command at a fixed interval, redrawing only the lines that changed"""
+        interval = 2.0
+        count = None
+        i = 0
+        while i < len(args) and args[i].startswith("-"):
+            if args[i] == "-n" and i + 1 < len(args):
+                i += 1
+                interval = max(0.01, float(args[i]))
+            elif args[i] == "-c" and i + 1 < len(args):
+                i += 1
+                count = max(1, int(args[i]))
+            else:
+                break
+            i += 1
+
+        command = _command_text(args[i:]) if args[i:] else ""
+        if not command:
+            return Failure("Usage: watch [-n seconds] [-c count] <command>")
+
+        previous = []
+        runs = 0
+        skipped = 0
+        sys.stdout.write("\033[2J")
+        next_run = time.monotonic()
+        try:
+            while True:
+                output = self.execute_command(command)
+                header = f"Every {interval:g}s: {command}    {time.strftime('%H:%M:%S')}"
+                lines = [header, ""] + output.splitlines()
+                sys.stdout.write(_screen_updates(previous, lines))
+                sys.stdout.flush()
+                previous = lines
+                runs += 1
+                if count is not None and runs >= count:
+                    break
+
+                # Schedule against the original start so sleeps don't accumulate drift;
+                # runs slower than the interval skip the ticks they overlapped
+                next_run += interval
+                now = time.monotonic()
+                if now > next_run:
+                    missed = int((now - next_run) // interval) + 1
+                    skipped += missed
+                    next_run += missed * interval
+                time.sleep(next_run - now)
+        except KeyboardInterrupt:
+            pass
+        return f"watch: {runs} run(s), {skipped} interval(s) skipped by slow runs"
+
+    def word_count(self, args):
+        """Count lines, words, bytes and characters, splitting large files across processes"""
+        flags = [arg for arg in args if arg.startswith("-") and len(arg) > 1]
+        files = [arg for arg in args if arg not in flags]
+        selected = set("".join(flag[1:] for flag in flags))
+        if not files or selected - set("lwcm"):
+            return Failure("Usage: wc [-l] [-w] [-c] [-m] <file>...")
+        columns = [c for c in "lwmc" if c in selected] or ["l", "w", "c"]
+        count_chars = "m" in columns
+
+        jobs = []
+        for name in files:
+            path = os.path.join(self.current_dir, name)
+            if not os.path.isfile(path):
+                return Failure(f"File not found: {name}")
+            if _compression_opener(path) is not None:
+                jobs.append([(path, 0, None, count_chars)])
+                continue
+            size = os.path.getsize(path)
+            parts = (os.cpu_count() or 1) if size >= WC_PARALLEL_THRESHOLD else 1
+            step = -(-size // parts) or 1
+            jobs.append([(path, start, min(start + step, size), count_chars)
+                         for start in range(0, max(size, 1), step)])
+
+        try:
+            flat = [job for ranges in jobs for job in ranges]
+            if len(flat) > 1 and any(len(ranges) > 1 for ranges in jobs):
+                with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                    results = iter(pool.map(_count_range, flat))
+            else:
+                results = iter(map(_count_range, flat))
+
+            rows = []
+            totals = dict.fromkeys("lwmc", 0)
+            for name, ranges in zip(files, jobs):
+                counts = dict.fromkeys("lwmc", 0)
+                previous_in_word = False
+                for _ in ranges:
+                    lines, words, size, chars, first_in_word, last_in_word = next(results)
+                    if previous_in_word and first_in_word:
+                        # A word straddles the range boundary
+                        words -= 1
+                    previous_in_word = last_in_word if size else previous_in_word
+                    counts["l"] += lines
+                    counts["w"] += words
+                    counts["c"] += size
+                    counts["m"] += chars
+                for key in totals:
+                    totals[key] += counts[key]
+                rows.append((counts, name))
+        except Exception as e:
+            return Failure(f"Error counting file: {str(e)}")
+
+        if len(rows) > 1:
+            rows.append((totals, "total"))
+        return "\n".join(" ".join(f"{counts[c]:>8}" for c in columns) + f" {name}" for counts, name in rows)
+
+    def grep(self, args):
+        """Print lines matching a regex, reading compressed files transparently"""
+        usage = Failure("Usage: grep [-i] [-v] [-n] [-c] <regex> <file>...")
+        flags = []
+        while args and args[0].startswith("-") and len(args[0]) > 1:
+            flags.append(args[0])
+            args = args[1:]
+        selected = set("".join(flag[1:] for flag in flags))
+        if selected - set("ivnc"):
+            return self._system_fallback("grep", flags + args)
+        if len(args) < 2:
+            return usage
+        pattern, files = args[0], args[1:]
+        try:
+            regex = re.compile(pattern.encode(), re.IGNORECASE if "i" in selected else 0)
+        except re.error as e:
+            return Failure(f"Error in pattern: {str(e)}")
+
+        output = []
+        total = 0
+        for name in files:
+            path = os.path.join(self.current_dir, name)
+            if not os.path.isfile(path):
+                return Failure(f"File not found: {name}")
+            prefix = f"{name}:" if len(files) > 1 else ""
+            matches = 0
+            try:
+                for number, line in enumerate(_file_lines(path), 1):
+                    if (regex.search(line) is None) != ("v" in selected):
+                        continue
+                    matches += 1
+                    if "c" not in selected:
+                        text = line.rstrip(b'\r').decode('utf-8', errors='replace')
+                        output.append(f"{prefix}{number}:{text}" if "n" in selected else f"{prefix}{text}")
+            except Exception as e:
+                return Failure(f"Error reading file: {str(e)}")
+            if "c" in selected:
+                output.append(f"{prefix}{matches}")
+            total += matches
+        # Like grep, selecting no lines at all is a failed search
+        return "\n".join(output) if total else Failure("\n".join(output))
+
+    def sort_lines(self, args):
+        """Sort lines in memory when they fit the budget, otherwise by external merge sort
+
+        Over budget, chunks are sorted into temporary run files by a process
+        pool and the runs are k-way merged with heapq.merge.
+        """
+        usage = Failure("Usage: sort [-k N[,M]] [-n] [-r] [-u] [-S budget] [-o out] <file>...")
+        first_field = last_field = 0
+        numeric = reverse = unique = False
+        budget = SORT_MEMORY_BUDGET
+        output = None
+        files = []
+        i = 0
+        try:
+            while i < len(args):
+                arg = args[i]
+                if arg in ("-k", "-S", "-o") and i + 1 < len(args):
+                    value = args[i + 1]
+                    i += 1
+                elif arg[:2] in ("-k", "-S", "-o") and len(arg) > 2:
+                    arg, value = arg[:2], arg[2:]
+                elif arg.startswith("-") and len(arg) > 1 and set(arg[1:]) <= set("nru"):
+                    numeric = numeric or "n" in arg
+                    reverse = reverse or "r" in arg
+                    unique = unique or "u" in arg
+                    i += 1
+                    continue
+                elif arg.startswith("-") and len(arg) > 1:
+                    return self._system_fallback("sort", args)
+                else:
+                    files.append(arg)
+                    i += 1
+                    continue
+                if arg == "-k":
+                    first, _, last = value.partition(",")
+                    first_field, last_field = int(first), int(last) if last else None
+                    if first_field < 1 or (last_field is not None and last_field < first_field):
+                        return usage
+                elif arg == "-S":
+                    budget = _parse_size(value)
+                else:
+                    output = os.path.join(self.current_dir, value)
+                i += 1
+        except ValueError:
+            return usage
+        if not files:
+            return usage
+        for name in files:
+            if not os.path.isfile(os.path.join(self.current_dir, name)):
+                return Failure(f"File not found: {name}")
+
+        key = None
+        if first_field or numeric:
+            key = functools.partial(_sort_key, first_field=first_field, last_field=last_field, numeric=numeric)
+
+        try:
+            with tempfile.TemporaryDirectory(prefix='sort-') as directory:
+                lines, total = self._sorted_lines(files, key, reverse, unique, budget, directory)
+                if output is not None:
+                    with open(output, 'wb', buffering=SORT_RUN_BUFFER) as f:
+                        for line in lines:
+                            f.write(line)
+                            f.write(b'\n')
+                    return f"Sorted {total} line(s) into {os.path.relpath(output, self.current_dir)}"
+                return b'\n'.join(lines).decode('utf-8', errors='replace')
+        except Exception as e:
+            return Failure(f"Error sorting: {str(e)}")
+
+    def _sorted_lines(self, files, key, reverse, unique, budget, directory):
+        """Return (sorted line iterator, input line count) for files, spilling runs to directory if needed"""
+        workers = os.cpu_count() or 1
+        run_budget = max(budget // workers, 1)
+        chunk, chunk_bytes, total = [], 0, 0
+        pool = None
+        pending, runs = [], []
+        try:
+            for name in files:
+                for line in _file_lines(os.path.join(self.current_dir, name)):
+                    chunk.append(line)
+                    chunk_bytes += len(line) + SORT_LINE_OVERHEAD
+                    total += 1
+                    # Everything is held in memory until the budget is reached; after that
+                    # smaller runs keep every worker busy without exceeding the budget
+                    if chunk_bytes < (run_budget if pool else budget):
+                        continue
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=workers)
+                        step = -(-len(chunk) // workers)
+                        pieces = [chunk[start:start + step] for start in range(0, len(chunk), step)]
+                    else:
+                        pieces = [chunk]
+                    for piece in pieces:
+                        if len(pending) >= workers:
+                            runs.append(pending.pop(0).result())
+                        pending.append(pool.submit(_sort_run, (piece, key, reverse, unique, directory)))
+                    chunk, chunk_bytes = [], 0
+
+            if pool is None:
+                chunk.sort(key=key, reverse=reverse)
+                return (_unique_lines(chunk, key) if unique else iter(chunk)), total
+            if chunk:
+                pending.append(pool.submit(_sort_run, (chunk, key, reverse, unique, directory)))
+            runs.extend(future.result() for future in pending)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        merged = _merge_runs(runs, key, reverse, directory)
+        return (_unique_lines(merged, key) if unique else merged), total
+
+    def unique_lines(self, args):
+        """Collapse runs of identical adjacent lines, streaming the input"""
+        count = "-c" in args
+        files = [arg for arg in args if arg != "-c"]
+        if any(arg.startswith("-") and len(arg) > 1 for arg in files):
+            return self._system_fallback("uniq", args)
+        if len(files) != 1:
+            return Failure("Usage: uniq [-c] <file>")
+        path = os.path.join(self.current_dir, files[0])
+        if not os.path.isfile(path):
+            return Failure(f"File not found: {files[0]}")
+
+        output = []
+        previous, repeats = None, 0
+        try:
+            for line in _file_lines(path):
+                if line == previous:
+                    repeats += 1
+                    continue
+                if previous is not None:
+                    output.append(self._uniq_line(previous, repeats, count))
+                previous, repeats = line, 1
+        except Exception as e:
+            return Failure(f"Error reading file: {str(e)}")
+        if previous is not None:
+            output.append(self._uniq_line(previous, repeats, count))
+        return "\n".join(output)
+
+    def _uniq_line(self, line, repeats, count):
+        text = line.decode('utf-8', errors='replace')
+        return f"{repeats:>7} {text}" if count else text
+
+    def _system_records(self, args):
+        """Yield one record per system metric"""
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        yield {"metric": "cpu_percent", "value": psutil.cpu_percent(interval=1)}
+        yield {"metric": "memory_percent", "value": memory.percent}
+        yield {"metric": "memory_used_bytes", "value": memory.used}
+        yield {"metric": "memory_total_bytes", "value": memory.total}
+        yield {"metric": "disk_percent", "value": disk.percent}
+        yield {"metric": "disk_used_bytes", "value": disk.used}
+        yield {"metric": "disk_total_bytes", "value": disk.total}
+        yield {"metric": "platform", "value": sys.platform}
 
     def get_system_info(self):
         """Get system information"""
         try:
-            cpu_percent = psutil.cpu_percent(interval=1)
-            memory = psutil.virtual_memory()
-            disk = psutil.disk_usage('/')
+            metrics = {record["metric"]: record["value"] for record in self._system_records([])}
+            gb = 1024 ** 3
             
             info = f"""
 🖥️  System Information:
-   CPU Usage: {cpu_percent}%
-   Memory: {memory.percent}% used ({memory.used // (1024**3)}GB / {memory.total // (1024**3)}GB)
-   Disk: {disk.percent}% used ({disk.used // (1024**3)}GB / {disk.total // (1024**3)}GB)
-   Platform: {sys.platform}
+   CPU Usage: {metrics['cpu_percent']}%
+   Memory: {metrics['memory_percent']}% used ({metrics['memory_used_bytes'] // gb}GB / {metrics['memory_total_bytes'] // gb}GB)
+   Disk: {metrics['disk_percent']}% used ({metrics['disk_used_bytes'] // gb}GB / {metrics['disk_total_bytes'] // gb}GB)
+   Platform: {metrics['platform']}
             """
             return info.strip()
         except Exception as e:
-            return f"Error getting system info: {str(e)}"
+            return Failure(f"Error getting system info: {str(e)}")
+
+    def _process_records(self, args):
+        """Yield one record per running process: pid, name and cpu"""
+        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent']):
+            yield {"pid": proc.info['pid'], "name": proc.info['name'], "cpu": proc.info['cpu_percent']}
 
     def list_processes(self):
         """List running processes"""
         try:
             processes = []
-            for proc in psutil.process_iter(['pid', 'name', 'cpu_percent']):
+            for record in self._process_records([]):
+                processes.append(f"PID: {record['pid']:>6} | {record['name']:<20} | CPU: {record['cpu']:>5.1f}%")
+                # Show top 10 processes
+                if len(processes) == 10:
+                    break
+            return "\n".join(processes)
+        except Exception as e:
+            return Failure(f"Error listing processes: {str(e)}")
+
+    def _process_index(self, attrs):
+        """Return (process, info) pairs from one process_iter pass, cached briefly
+
+        pgrep followed by pkill reuses the same pass; psutil keeps the
+        Process handles themselves between passes. The info dicts are kept
+        separately because psutil overwrites proc.info on every pass.
+        """
+        key = tuple(sorted(set(attrs) | {'pid'}))
+        now = time.monotonic()
+        cached = self._process_index_cache.get(key)
+        if cached and now - cached[0] < PROCESS_INDEX_TTL:
+            return cached[1]
+        index = [(proc, proc.info) for proc in psutil.process_iter(list(key))]
+        self._process_index_cache[key] = (now, index)
+        return index
+
+    def _parse_process_match(self, args, extra_flags=()):
+        """Parse pgrep/pkill matching flags; returns (options, remaining flags)"""
+        options = {"full": False, "exact": False, "ignore_case": False, "list": False,
+                   "user": None, "pattern": None}
+        extras = {}
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-f":
+                options["full"] = True
+            elif arg == "-x":
+                options["exact"] = True
+            elif arg == "-i":
+                options["ignore_case"] = True
+            elif arg == "-l":
+                options["list"] = True
+            elif arg == "-u" and i + 1 < len(args):
+                i += 1
+                options["user"] = args[i]
+            elif arg in extra_flags and i + 1 < len(args):
+                i += 1
+                extras[arg] = args[i]
+            elif arg.startswith("-") and arg not in extra_flags and options["pattern"] is None and len(arg) > 1:
+                extras.setdefault("signal", arg[1:])
+            elif options["pattern"] is None:
+                options["pattern"] = arg
+            else:
+                raise ValueError("only one pattern may be given")
+            i += 1
+        if options["pattern"] is None and options["user"] is None:
+            raise ValueError("a pattern or -u <user> is required")
+        return options, extras
+
+    def _matching_processes(self, options):
+        """Return (process, info) pairs matching parsed pgrep/pkill options"""
+        attrs = ['name']
+        if options["full"]:
+            attrs.append('cmdline')
+        if options["user"]:
+            attrs.append('username')
+
+        regex = None
+        if options["pattern"] is not None:
+            pattern = options["pattern"]
+            if options["exact"]:
+                pattern = f"(?:{pattern})\\Z"
+            regex = re.compile(pattern, re.IGNORECASE if options["ignore_case"] else 0)
+
+        own_pid = os.getpid()
+        matches = []
+        for proc, info in self._process_index(attrs):
+            if info['pid'] == own_pid:
+                continue
+            if options["user"] and info.get('username') != options["user"]:
+                continue
+            if regex:
+                target = " ".join(info.get('cmdline') or []) if options["full"] else info.get('name') or ""
+                if not regex.match(target) if options["exact"] else not regex.search(target):
+                    continue
+            matches.append((proc, info))
+        return matches
+
+    def _pgrep_records(self, args):
+        """Yield one record per process matching the pgrep query"""
+        options, _ = self._parse_process_match(args)
+        for _, info in self._matching_processes(options):
+            record = {"pid": info['pid'], "name": info['name']}
+            if 'cmdline' in info:
+                record["cmdline"] = info['cmdline']
+            if 'username' in info:
+                record["user"] = info['username']
+            yield record
+
+    def pgrep(self, args):
+        """List processes matching a name, command line or user"""
+        usage = Failure("Usage: pgrep [-f] [-x] [-i] [-l] [-u user] <regex>")
+        try:
+            options, extras = self._parse_process_match(args)
+            if extras:
+                return usage
+            matches = self._matching_processes(options)
+        except ValueError:
+            return usage
+        except re.error as e:
+            return Failure(f"Invalid regex: {str(e)}")
+        except Exception as e:
+            return Failure(f"Error listing processes: {str(e)}")
+
+        if not matches:
+            return Failure("No matching processes")
+        if options["list"]:
+            return "\n".join(f"{info['pid']} {info['name']}" for _, info in matches)
+        return "\n".join(str(info['pid']) for _, info in matches)
+
+    def pkill(self, args):
+        """Signal every matching process, escalating to SIGKILL after a grace period"""
+        usage = Failure("Usage: pkill [-SIGNAL] [-t grace_secs] [-f] [-x] [-i] [-u user] <regex>")
+        try:
+            options, extras = self._parse_process_match(args, extra_flags=("-t",))
+            grace = float(extras.get("-t", 5))
+            name = extras.get("signal", "TERM").upper()
+            if name.isdigit():
+                sig = signal.Signals(int(name))
+            else:
+                sig = signal.Signals[name if name.startswith("SIG") else f"SIG{name}"]
+            matches = self._matching_processes(options)
+        except (ValueError, KeyError):
+            return usage
+        except re.error as e:
+            return Failure(f"Invalid regex: {str(e)}")
+        except Exception as e:
+            return Failure(f"Error listing processes: {str(e)}")
+
+        if not matches:
+            return Failure("No matching processes")
+
+        signalled = []
+        failed = 0
+        for proc, _ in matches:
+            try:
+                proc.send_signal(sig)
+                signalled.append(proc)
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                failed += 1
+
+        killed = 0
+        if sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT) and signalled:
+            # Wait for all of them at once, then force whatever is left
+            _, alive = psutil.wait_procs(signalled, timeout=grace)
+            for proc in alive:
                 try:
-                    processes.append(f"PID: {proc.info['pid']:>6} | {proc.info['name']:<20} | CPU: {proc.info['cpu_percent']:>5.1f}%")
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    proc.kill()
+                    killed += 1
+                except psutil.NoSuchProcess:
                     pass
-            
-            # Show top 10 processes
-            return "\n".join(processes[:10])
+                except psutil.AccessDenied:
+                    failed += 1
+            if alive:
+                psutil.wait_procs(alive, timeout=1)
+
+        self._process_index_cache.clear()
+        result = f"Sent {sig.name} to {len(signalled)} process(es)"
+        if killed:
+            result += f", {killed} killed with SIGKILL after {grace:g}s"
+        if failed:
+            result += f", {failed} not permitted"
+        return result
+
+    def _parse_top_args(self, args):
+        """Parse iotop/nettop flags into (interval, top_n)"""
+        interval = 1.0
+        top_n = 10
+        i = 0
+        while i < len(args):
+            if args[i] == "-i" and i + 1 < len(args):
+                i += 1
+                interval = max(0.05, float(args[i]))
+            elif args[i] == "-n" and i + 1 < len(args):
+                i += 1
+                top_n = max(1, int(args[i]))
+            else:
+                raise ValueError(f"unknown option: {args[i]}")
+            i += 1
+        return interval, top_n
+
+    def _sample_io(self):
+        """Return {pid: (name, read_bytes, write_bytes)} for processes whose I/O counters are readable"""
+        sample = {}
+        for proc in psutil.process_iter(['name', 'io_counters']):
+            io = proc.info['io_counters']
+            if io is not None:
+                sample[proc.pid] = (proc.info['name'], io.read_bytes, io.write_bytes)
+        return sample
+
+    def _io_top_records(self, args):
+        """Yield processes ranked by disk throughput between two samples"""
+        interval, top_n = self._parse_top_args(args)
+        before = self._sample_io()
+        started = time.monotonic()
+        time.sleep(interval)
+        after = self._sample_io()
+        elapsed = time.monotonic() - started
+
+        rows = []
+        for pid, (name, read_bytes, write_bytes) in after.items():
+            if pid not in before:
+                continue
+            read_rate = (read_bytes - before[pid][1]) / elapsed
+            write_rate = (write_bytes - before[pid][2]) / elapsed
+            rows.append({"pid": pid, "name": name,
+                         "read_bytes_per_sec": read_rate, "write_bytes_per_sec": write_rate})
+        rows.sort(key=lambda row: row["read_bytes_per_sec"] + row["write_bytes_per_sec"], reverse=True)
+        yield from rows[:top_n]
+
+    def io_top(self, args):
+        """Show the processes doing the most disk I/O"""
+        try:
+            rows = list(self._io_top_records(args))
+        except ValueError:
+            return Failure("Usage: iotop [-i seconds] [-n N]")
         except Exception as e:
-            return f"Error listing processes: {str(e)}"
+            return Failure(f"Error sampling process I/O: {str(e)}")
+        if not rows:
+            return Failure("No readable process I/O counters")
+
+        result = [f"{'PID':>7} | {'NAME':<20} | {'READ/s':>10} | {'WRITE/s':>10}"]
+        for row in rows:
+            result.append(f"{row['pid']:>7} | {row['name'][:20]:<20} | "
+                          f"{_format_size(row['read_bytes_per_sec']):>10} | "
+                          f"{_format_size(row['write_bytes_per_sec']):>10}")
+        return "\n".join(result)
+
+    def _sample_connections(self):
+        """Return {pid: (name, connections, established)} from one pass over the connection table"""
+        counts = {}
+        try:
+            connections = psutil.net_connections(kind='inet')
+        except psutil.AccessDenied:
+            connections = None
+
+        if connections is not None:
+            for conn in connections:
+                if conn.pid is None:
+                    continue
+                total, established = counts.get(conn.pid, (0, 0))
+                counts[conn.pid] = (total + 1, established + (conn.status == psutil.CONN_ESTABLISHED))
+            names = {proc.pid: proc.info['name'] for proc in psutil.process_iter(['name'])}
+            return {pid: (names.get(pid, "?"), *count) for pid, count in counts.items()}
+
+        # Platforms without a readable global table: ask each process we can
+        sample = {}
+        for proc in psutil.process_iter(['name']):
+            try:
+                conns = (proc.net_connections if hasattr(proc, 'net_connections') else proc.connections)(kind='inet')
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            if conns:
+                established = sum(conn.status == psutil.CONN_ESTABLISHED for conn in conns)
+                sample[proc.pid] = (proc.info['name'], len(conns), established)
+        return sample
+
+    def _net_top_records(self, args):
+        """Yield processes ranked by connection count, with the change between two samples"""
+        interval, top_n = self._parse_top_args(args)
+        before = self._sample_connections()
+        time.sleep(interval)
+        after = self._sample_connections()
+
+        rows = []
+        for pid, (name, connections, established) in after.items():
+            rows.append({"pid": pid, "name": name, "connections": connections,
+                         "established": established,
+                         "delta": connections - before.get(pid, (name, 0, 0))[1]})
+        rows.sort(key=lambda row: (row["connections"], row["delta"]), reverse=True)
+        yield from rows[:top_n]
+
+    def net_top(self, args):
+        """Show the processes holding the most network connections"""
+        try:
+            rows = list(self._net_top_records(args))
+        except ValueError:
+            return Failure("Usage: nettop [-i seconds] [-n N]")
+        except Exception as e:
+            return Failure(f"Error sampling connections: {str(e)}")
+        if not rows:
+            return "No network connections found"
+
+        result = [f"{'PID':>7} | {'NAME':<20} | {'CONNS':>6} | {'ESTAB':>6} | {'CHANGE':>6}"]
+        for row in rows:
+            result.append(f"{row['pid']:>7} | {row['name'][:20]:<20} | {row['connections']:>6} | "
+                          f"{row['established']:>6} | {row['delta']:>+6}")
+        return "\n".join(result)
+
+    def _parse_parallel_args(self, args):
+        """Parse parallel options into (jobs, keep_order, template, inputs)"""
+        jobs = os.cpu_count() or 1
+        keep_order = False
+        arg_file = None
+        i = 0
+        while i < len(args) and args[i].startswith("-"):
+            if args[i] == "-j" and i + 1 < len(args):
+                i += 1
+                jobs = max(1, int(args[i]))
+            elif args[i] == "-k":
+                keep_order = True
+            elif args[i] == "-a" and i + 1 < len(args):
+                i += 1
+                arg_file = args[i]
+            else:
+                raise ValueError(f"unknown option: {args[i]}")
+            i += 1
+
+        rest = args[i:]
+        if ":::" in rest:
+            split = rest.index(":::")
+            template, inputs = rest[:split], rest[split + 1:]
+        elif arg_file == "-":
+            template, inputs = rest, [line.rstrip("\n") for line in sys.stdin]
+        elif arg_file is not None:
+            with open(os.path.join(self.current_dir, arg_file)) as f:
+                template, inputs = rest, [line.rstrip("\n") for line in f]
+        else:
+            raise ValueError("no arguments given")
+        if not template:
+            raise ValueError("no command template given")
+        return jobs, keep_order, template, [value for value in inputs if value]
+
+    def _parallel_records(self, args):
+        """Yield one record per job as jobs finish (or in input order with -k)"""
+        jobs, keep_order, template, inputs = self._parse_parallel_args(args)
+        # A lone template argument is a whole command line, so look at its first word
+        first_word = (shlex.split(template[0]) or [""])[0] if len(template) == 1 else template[0]
+        builtin = first_word.lower() in BUILTIN_COMMANDS
+        if len(template) == 1:
+            # A single argument is a command line of its own (see _command_text)
+            line = template[0] if "{}" in template[0] else template[0] + " {}"
+            commands = [line.replace("{}", shlex.quote(value)) for value in inputs]
+        else:
+            if not any("{}" in word for word in template):
+                template = template + ["{}"]
+            commands = [shlex.join([word.replace("{}", value) for word in template]) for value in inputs]
+        if builtin:
+            # Builtins run Python code, so they need processes to use every core
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            work = [(i, self.current_dir, self.state_dir, command) for i, command in enumerate(commands)]
+            run = _run_builtin_job
+        else:
+            # External commands are already separate processes; threads just wait on them
+            pool = ThreadPoolExecutor(max_workers=jobs)
+            work = [(i, self.current_dir, self._with_shell_variables(command), self.command_limits)
+                    for i, command in enumerate(commands)]
+            run = _run_external_job
+
+        with pool:
+            futures = [pool.submit(run, job) for job in work]
+            for future in (futures if keep_order else as_completed(futures)):
+                index, exit_code, output, seconds = future.result()
+                yield {"job": index + 1, "command": commands[index], "exit_code": exit_code,
+                       "output": output, "seconds": round(seconds, 6)}
 
-    def execute_system_command(self, command):
+    def run_parallel(self, args):
+        """Run a command template once per argument across a worker pool"""
+        started = time.perf_counter()
+        try:
+            outputs = []
+            failures = []
+            total = 0
+            for record in self._parallel_records(args):
+                total += 1
+                if record["output"]:
+                    outputs.append(record["output"].rstrip("\n"))
+                if record["exit_code"] != 0:
+                    failures.append(record)
+        except (ValueError, OSError) as e:
+            return Failure(f"Usage: parallel [-j N] [-k] [-a file|-] <command {{}}> [::: args...] ({str(e)})")
+
+        elapsed = time.perf_counter() - started
+        outputs.append(f"⚡ {total} job(s), {len(failures)} failed in {elapsed:.2f}s "
+                       f"({total / elapsed if elapsed else 0:.1f} jobs/s)")
+        for record in sorted(failures, key=lambda r: r["job"])[:10]:
+            outputs.append(f"   ✗ job {record['job']} exited {record['exit_code']}: {record['command']}")
+        if len(failures) > 10:
+            outputs.append(f"   ... and {len(failures) - 10} more")
+        output = "\n".join(outputs)
+        return Failure(output) if failures else output
+
+    def configure_limits(self, args):
+        """Show or set the timeout and rlimits applied to system commands"""
+        options = {"-w": "timeout", "-t": "cpu", "-v": "memory"}
+        try:
+            i = 0
+            while i < len(args):
+                if args[i] in options and i + 1 < len(args):
+                    value = args[i + 1]
+                    key = options[args[i]]
+                    if value == "unlimited":
+                        self.command_limits[key] = None
+                    elif key == "memory":
+                        self.command_limits[key] = _parse_size(value)
+                    else:
+                        self.command_limits[key] = float(value)
+                elif args[i] == "-r" and i + 1 < len(args) and args[i + 1] in ("on", "off"):
+                    self.report_usage = args[i + 1] == "on"
+                else:
+                    raise ValueError(args[i])
+                i += 2
+        except ValueError:
+            return Failure("Usage: ulimit [-w wall_secs] [-t cpu_secs] [-v bytes[K|M|G]] [-r on|off] (use 'unlimited' to clear)")
+
+        limits = self.command_limits
+        seconds = lambda value: f"{value:g}s" if value else "unlimited"
+        result = [
+            f"Wall timeout:  {seconds(limits['timeout'])}",
+            f"CPU time:      {seconds(limits['cpu'])}",
+            f"Address space: {_format_size(limits['memory']) if limits['memory'] else 'unlimited'}",
+            f"Usage report:  {'on' if self.report_usage else 'off'}",
+        ]
+        if self.last_usage:
+            result.append(f"Last command:  {self.last_usage}")
+        return "\n".join(result)
+
+    def run_with_timeout(self, args):
+        """Run one system command with its own wall-clock timeout"""
+        if args and args[0].startswith("-") and len(args[0]) > 1:
+            return self._system_fallback("timeout", args)
+        if len(args) < 2:
+            return Failure("Usage: timeout <seconds>[s|m|h|d] <command>")
+        try:
+            seconds = _parse_duration(args[0])
+        except ValueError:
+            return Failure("Usage: timeout <seconds>[s|m|h|d] <command>")
+        return self.execute_system_command(_command_text(args[1:]), timeout=seconds)
+
+    def _system_fallback(self, cmd, args):
+        """Hand a builtin's command line to the system tool of the same name, for options the builtin lacks"""
+        return self.execute_system_command(shlex.join([cmd] + args))
+
+    def execute_system_command(self, command, timeout=None):
         """Execute system command"""
+        limits = dict(self.command_limits)
+        if timeout is not None:
+            limits['timeout'] = timeout
         try:
-            result = subprocess.run(command, shell=True, capture_output=True, text=True, cwd=self.current_dir)
-            if result.stdout:
-                return result.stdout
-            elif result.stderr:
-                return f"Error: {result.stderr}"
+            started = time.perf_counter()
+            exit_code, stdout, stderr, usage, timed_out = _run_limited(
+                self._with_shell_variables(command), self.current_dir, limits)
+            self.last_usage = _format_rusage(exit_code, usage, time.perf_counter() - started)
+            # Signals map to 128 + signal number, as in POSIX shells
+            self.last_status = exit_code if exit_code >= 0 else 128 - exit_code
+            if timed_out:
+                result = f"Command timed out after {limits['timeout']:g}s (process group killed)"
+            elif stdout:
+                result = stdout
+            elif stderr:
+                result = f"Error: {stderr}"
+            elif exit_code < 0:
+                result = f"Command failed: killed by {signal.Signals(-exit_code).name}"
             else:
-                return "Command executed successfully"
+                result = "Command executed successfully"
+            if self.report_usage or timed_out:
+                result = result.rstrip("\n") + "\n" + self.last_usage
+            return result
         except Exception as e:
+            self.last_status = 127
             return f"Command failed: {str(e)}"
 
+    def _with_shell_variables(self, command):
+        """Prefix a shell command line with the session variables, so the shell expands them too
+
+        Exported variables are in the environment already; plain assignments
+        make the rest visible to the shell without exporting them.
+        """
+        if not self.variables:
+            return command
+        assignments = [f"{name}={shlex.quote(value)}" for name, value in self.variables.items()]
+        return "\n".join(assignments + [command])
+
+    def record_session(self, args):
+        """Start or stop recording this session to an append-only log"""
+        if len(args) == 2 and args[0] == "start":
+            if self.recorder is not None:
+                return Failure(f"Already recording to {self.recorder.path}")
+            path = os.path.join(self.current_dir, args[1])
+            try:
+                self.recorder = SessionRecorder(path, self.current_dir)
+            except OSError as e:
+                return Failure(f"Failed to start recording: {str(e)}")
+            return f"🔴 Recording to {args[1]}"
+        if args == ["stop"]:
+            if self.recorder is None:
+                return Failure("Not recording")
+            recorder, self.recorder = self.recorder, None
+            recorder.close()
+            return f"⏹️  Recorded {recorder.count} command(s) to {recorder.path}"
+        return Failure("Usage: record start <file> | record stop")
+
+    def _replay_one(self, cwd, records, original_pace):
+        """Replay records in a fresh terminal; returns [(command, latency, diverged)]"""
+        terminal = SimpleTerminal()
+        terminal.current_dir = cwd
+        terminal.state_dir = self.state_dir
+        results = []
+        first_timestamp = records[0][0] if records else 0
+        started = time.monotonic()
+        for timestamp, _, command, expected in records:
+            if original_pace:
+                delay = (timestamp - first_timestamp) - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            before = time.perf_counter()
+            output = terminal.execute_command(command)
+            results.append((command, time.perf_counter() - before, output != expected))
+        return results
+
+    def replay_session(self, args):
+        """Replay a recorded session at original pace or full speed across N concurrent sessions"""
+        original_pace = True
+        sessions = 1
+        cwd = None
+        paths = []
+        try:
+            i = 0
+            while i < len(args):
+                if args[i] == "--max":
+                    original_pace = False
+                elif args[i] == "-c" and i + 1 < len(args):
+                    i += 1
+                    sessions = max(1, int(args[i]))
+                elif args[i] == "--cwd" and i + 1 < len(args):
+                    i += 1
+                    cwd = os.path.join(self.current_dir, args[i])
+                else:
+                    paths.append(args[i])
+                i += 1
+            if len(paths) != 1:
+                raise ValueError
+        except ValueError:
+            return Failure("Usage: replay <file> [--max] [-c sessions] [--cwd dir]")
+
+        try:
+            recorded_cwd, records = _read_session_log(os.path.join(self.current_dir, paths[0]))
+        except FileNotFoundError:
+            return Failure(f"File not found: {paths[0]}")
+        except Exception as e:
+            return Failure(f"Error reading session log: {str(e)}")
+        if not records:
+            return Failure("Session log is empty")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            futures = [pool.submit(self._replay_one, cwd or recorded_cwd, records, original_pace)
+                       for _ in range(sessions)]
+            results = [result for future in futures for result in future.result()]
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency, _ in results)
+        recorded = sorted(duration for _, duration, _, _ in records)
+        diverged = {}
+        for command, _, differs in results:
+            if differs:
+                diverged[command] = diverged.get(command, 0) + 1
+
+        ms = lambda seconds: f"{seconds * 1000:.2f}ms"
+        report = [
+            f"🔁 Replayed {len(records)} command(s) x {sessions} session(s) "
+            f"{'at original pace' if original_pace else 'at max speed'} in {elapsed:.2f}s",
+            f"   Throughput: {len(results) / elapsed if elapsed else 0:.1f} commands/s",
+            f"   Latency:    p50 {ms(_percentile(latencies, 0.5))} | p90 {ms(_percentile(latencies, 0.9))} | "
+            f"p99 {ms(_percentile(latencies, 0.99))} | max {ms(latencies[-1])}",
+            f"   Recorded:   p50 {ms(_percentile(recorded, 0.5))} | p99 {ms(_percentile(recorded, 0.99))}",
+            f"   Divergent outputs: {sum(diverged.values())} of {len(results)}",
+        ]
+        for command, count in sorted(diverged.items(), key=lambda item: item[1], reverse=True)[:5]:
+            report.append(f"      {count:>5} x {command}")
+        return "\n".join(report)
+
     def _init_ascii_patterns(self):
         """Initialize ASCII art patterns and templates"""
         return {
@@ -359,6 +3562,16 @@ Available Commands:
         # Generate random creative art
         return self._create_random_art(prompt)
 
+    def _ascii_dependencies(self, args):
+        """Cache only prompts that select fixed art; patterns and creative art are picked at random"""
+        prompt = " ".join(args).lower()
+        if not args or any(key in prompt for category, items in self.ascii_patterns.items()
+                           if category != 'text_styles' for key in items):
+            return []
+        if any(word in prompt for word in ['text', 'word', 'letter', 'name']) and self._extract_text_from_prompt(prompt):
+            return []
+        return None
+
     def _show_ascii_help(self):
         """Show ASCII art help and examples"""
         help_text = """
@@ -472,7 +3685,7 @@ Available categories:
                 result.append(line)
             return self._format_ascii_art(result, text.upper())
         
-        return "Text art generation failed"
+        return Failure("Text art generation failed")
 
     def _create_geometric_pattern(self, prompt):
         """Create geometric ASCII patterns"""
@@ -573,6 +3786,12 @@ Available categories:
             try:
                 command = input(self.get_prompt())
                 if command.strip():
+                    records = self.record_stream(command)
+                    if records is not None:
+                        # Print records as they are produced instead of buffering the listing
+                        for line in records:
+                            print(line)
+                        continue
                     result = self.execute_command(command)
                     if result:
                         print(result)
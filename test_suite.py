@@ -12,10 +12,20 @@ This test suite demonstrates all features of the terminal application:
 """
 
 import os
+import re
 import sys
 import tempfile
+import hashlib
+import io
+import json
+import contextlib
 import shutil
-from simple_terminal import SimpleTerminal
+import subprocess
+import socket
+import threading
+import time
+import simple_terminal
+from simple_terminal import SimpleTerminal, _screen_updates
 
 class TerminalTestSuite:
     def __init__(self):
@@ -27,6 +37,7 @@ class TerminalTestSuite:
         """Create a temporary directory for testing"""
         self.test_dir = tempfile.mkdtemp(prefix="terminal_test_")
         self.terminal.current_dir = self.test_dir
+        self.terminal.state_dir = os.path.join(self.test_dir, ".state")
         print(f"🧪 Test environment created: {self.test_dir}")
         
     def cleanup_test_environment(self):
@@ -96,6 +107,811 @@ class TerminalTestSuite:
         
         return "File operations working correctly"
     
+    def test_copy_and_move(self):
+        """Test cp and mv builtins"""
+        print("\n📦 Testing Copy and Move")
+        self.terminal.current_dir = self.test_dir
+        
+        src_dir = os.path.join(self.test_dir, "copy_src")
+        os.makedirs(os.path.join(src_dir, "nested"))
+        with open(os.path.join(src_dir, "a.txt"), 'w') as f:
+            f.write("alpha")
+        with open(os.path.join(src_dir, "nested", "b.txt"), 'w') as f:
+            f.write("beta" * 1000)
+        
+        # Test single file copy
+        result = self.terminal.execute_command("cp copy_src/a.txt a_copy.txt")
+        assert "Copied 1 file(s)" in result, result
+        with open(os.path.join(self.test_dir, "a_copy.txt")) as f:
+            assert f.read() == "alpha"
+        
+        # Test directory copy requires -r
+        result = self.terminal.execute_command("cp copy_src copy_dst")
+        assert "is a directory" in result
+        result = self.terminal.execute_command("cp -r -j 2 copy_src copy_dst")
+        assert "Copied 2 file(s)" in result, result
+        with open(os.path.join(self.test_dir, "copy_dst", "nested", "b.txt")) as f:
+            assert f.read() == "beta" * 1000
+        
+        # Test resuming a partial copy
+        partial = os.path.join(self.test_dir, "partial.txt")
+        with open(partial, 'w') as f:
+            f.write("beta" * 10)
+        self.terminal.execute_command("cp --resume copy_src/nested/b.txt partial.txt")
+        with open(partial) as f:
+            assert f.read() == "beta" * 1000
+        
+        # Copying a file onto itself must not truncate it
+        result = self.terminal.execute_command("cp a_copy.txt a_copy.txt")
+        assert "are the same file" in result, result
+        self.terminal.current_dir = src_dir
+        result = self.terminal.execute_command("cp a.txt .")
+        assert "are the same file" in result, result
+        self.terminal.current_dir = self.test_dir
+        for path in ("a_copy.txt", os.path.join("copy_src", "a.txt")):
+            with open(os.path.join(self.test_dir, path)) as f:
+                assert f.read() == "alpha"
+        
+        # Options the builtin lacks go to the system cp
+        self.terminal.execute_command("cp -v copy_src/a.txt verbose.txt")
+        assert os.path.exists(os.path.join(self.test_dir, "verbose.txt"))
+        os.remove(os.path.join(self.test_dir, "verbose.txt"))
+        
+        # Nor can a directory be copied into its own subtree
+        result = self.terminal.execute_command("cp -r copy_src copy_src/nested/copy")
+        assert "into itself" in result, result
+        assert not os.path.exists(os.path.join(src_dir, "nested", "copy"))
+        
+        # Test mv
+        result = self.terminal.execute_command("mv a_copy.txt moved.txt")
+        assert "Moved" in result
+        assert os.path.exists(os.path.join(self.test_dir, "moved.txt"))
+        assert not os.path.exists(os.path.join(self.test_dir, "a_copy.txt"))
+        
+        shutil.rmtree(src_dir)
+        shutil.rmtree(os.path.join(self.test_dir, "copy_dst"))
+        return "Copy and move working correctly"
+    
+    def test_hash_files(self):
+        """Test hash builtin and its digest cache"""
+        print("\n#️⃣ Testing File Hashing")
+        self.terminal.current_dir = self.test_dir
+        self.terminal.state_dir = os.path.join(self.test_dir, ".state")
+        
+        hash_dir = os.path.join(self.test_dir, "hash_src")
+        os.makedirs(hash_dir)
+        for name, content in [("one.txt", b"one"), ("two.txt", b"two")]:
+            with open(os.path.join(hash_dir, name), 'wb') as f:
+                f.write(content)
+        
+        result = self.terminal.execute_command("hash -a md5 hash_src")
+        assert hashlib.md5(b"one").hexdigest() in result, result
+        assert hashlib.md5(b"two").hexdigest() in result
+        assert "0 from cache" in result
+        
+        # Second run should be served from the cache
+        result = self.terminal.execute_command("hash -a md5 hash_src")
+        assert "2 from cache" in result, result
+        
+        # Unreadable entries are reported on their own and the rest still hash
+        os.symlink("nowhere", os.path.join(hash_dir, "broken"))
+        result = self.terminal.execute_command("hash -a md5 hash_src")
+        assert "broken: No such file or directory" in result, result
+        assert hashlib.md5(b"one").hexdigest() in result, result
+        assert "2 file(s) hashed" in result, result
+        assert self.terminal.last_status == 1
+        os.remove(os.path.join(hash_dir, "broken"))
+        
+        result = self.terminal.execute_command("hash -a crc hash_src")
+        assert "Unsupported algorithm" in result
+        
+        # The mmap path hashes memoryview slices and must match a plain read
+        threshold = simple_terminal.HASH_MMAP_THRESHOLD
+        simple_terminal.HASH_MMAP_THRESHOLD = 1
+        try:
+            path = os.path.join(hash_dir, "one.txt")
+            assert simple_terminal._hash_file((path, "sha256")) == hashlib.sha256(b"one").hexdigest()
+        finally:
+            simple_terminal.HASH_MMAP_THRESHOLD = threshold
+        
+        shutil.rmtree(hash_dir)
+        return "File hashing working correctly"
+    
+    def test_disk_usage(self):
+        """Test du builtin and its incremental rescans"""
+        print("\n💾 Testing Disk Usage")
+        self.terminal.current_dir = self.test_dir
+        self.terminal.state_dir = os.path.join(self.test_dir, ".state")
+        
+        du_dir = os.path.join(self.test_dir, "du_src")
+        os.makedirs(os.path.join(du_dir, "big"))
+        os.makedirs(os.path.join(du_dir, "small"))
+        with open(os.path.join(du_dir, "big", "data.bin"), 'wb') as f:
+            f.write(os.urandom(256 * 1024))
+        with open(os.path.join(du_dir, "small", "data.bin"), 'wb') as f:
+            f.write(b"x")
+        
+        result = self.terminal.execute_command("du du_src")
+        lines = result.splitlines()
+        assert lines[0].endswith("big/"), result
+        assert "3 directories (3 rescanned)" in result
+        
+        # Nothing changed, so nothing should be rescanned
+        result = self.terminal.execute_command("du -n 1 du_src")
+        assert "(0 rescanned)" in result, result
+        assert len(result.splitlines()) == 2
+        
+        # A file growing in place leaves its directory's mtime unchanged
+        with open(os.path.join(du_dir, "small", "data.bin"), 'ab') as f:
+            f.write(os.urandom(1024 * 1024))
+        result = self.terminal.execute_command("du du_src")
+        assert result.splitlines()[0].endswith("small/"), result
+        assert "(0 rescanned)" in result, result
+        assert result == self.terminal.execute_command("du --no-cache du_src").replace("(3 rescanned)", "(0 rescanned)")
+        
+        # Options the builtin lacks are handed to the system du
+        result = self.terminal.execute_command("du -sh du_src")
+        assert result.split()[1] == "du_src", result
+        assert self.terminal.last_status == 0
+        
+        shutil.rmtree(du_dir)
+        return "Disk usage working correctly"
+    
+    def test_locate(self):
+        """Test updatedb and locate builtins"""
+        print("\n🔎 Testing Locate")
+        self.terminal.current_dir = self.test_dir
+        self.terminal.state_dir = os.path.join(self.test_dir, ".state")
+        
+        locate_dir = os.path.join(self.test_dir, "locate_src")
+        os.makedirs(os.path.join(locate_dir, "reports"))
+        for name in ["Quarterly_Report.pdf", "notes.txt", "reports/annual_report.pdf"]:
+            open(os.path.join(locate_dir, name), 'w').close()
+        
+        result = self.terminal.execute_command("locate report")
+        assert "Run 'updatedb' first" in result
+        assert self.terminal.last_status == 1
+        
+        result = self.terminal.execute_command("updatedb locate_src")
+        assert "Indexed 5 paths" in result, result
+        
+        result = self.terminal.execute_command("locate annual")
+        assert result.endswith(os.path.join("reports", "annual_report.pdf")), result
+        
+        result = self.terminal.execute_command("locate -i quarterly")
+        assert "Quarterly_Report.pdf" in result
+        assert "No matches" in self.terminal.execute_command("locate quarterly")
+        
+        result = self.terminal.execute_command("locate -r report\\.pdf$")
+        assert len(result.splitlines()) == 1, result
+        
+        # Usage errors fail with the usage text
+        result = self.terminal.execute_command("locate -l many report")
+        assert result.startswith("Usage: locate"), result
+        assert self.terminal.last_status == 1
+        
+        # Literals inside an optional group are not required
+        result = self.terminal.execute_command("locate -r 'annual(_final)?_report'")
+        assert result.endswith("annual_report.pdf"), result
+        assert simple_terminal._required_literals("report(final)?\\.txt", True) == ["report", "txt"]
+        
+        # New files show up after an incremental update
+        open(os.path.join(locate_dir, "reports", "draft_report.pdf"), 'w').close()
+        result = self.terminal.execute_command("updatedb")
+        assert "1 directories rescanned" in result, result
+        assert "draft_report.pdf" in self.terminal.execute_command("locate draft")
+        
+        shutil.rmtree(locate_dir)
+        return "Locate working correctly"
+    
+    def test_watch(self):
+        """Test watch builtin and its partial redraws"""
+        print("\n⏱️ Testing Watch")
+        self.terminal.current_dir = self.test_dir
+        
+        updates = _screen_updates(["header", "", "a", "b"], ["header", "", "a", "c"])
+        assert updates.count("\033[K") == 1, repr(updates)
+        assert "c" in updates and "a\033[K" not in updates
+        
+        # Shorter output clears the leftover rows
+        updates = _screen_updates(["x", "y", "z"], ["x"])
+        assert updates.count("\033[K") == 2
+        
+        screen = io.StringIO()
+        with contextlib.redirect_stdout(screen):
+            result = self.terminal.execute_command("watch -n 0.01 -c 3 echo hello")
+        assert "3 run(s)" in result, result
+        assert screen.getvalue().count("\033[3;1Hhello") == 1, repr(screen.getvalue())
+        
+        # A single quoted argument is a command line, so pipelines can be watched
+        screen = io.StringIO()
+        with contextlib.redirect_stdout(screen):
+            self.terminal.execute_command('watch -n 0.01 -c 1 "echo piped | tr a-z A-Z"')
+        assert "\033[3;1HPIPED" in screen.getvalue(), repr(screen.getvalue())
+        
+        result = self.terminal.execute_command("watch -n 1")
+        assert "Usage:" in result
+        
+        return "Watch working correctly"
+    
+    def test_word_count(self):
+        """Test wc builtin, including files split into parallel ranges"""
+        print("\n🔢 Testing Word Count")
+        self.terminal.current_dir = self.test_dir
+        
+        wc_file = os.path.join(self.test_dir, "wc.txt")
+        with open(wc_file, 'w', encoding='utf-8') as f:
+            f.write("héllo world\n  foo  bar baz\nlast")
+        
+        result = self.terminal.execute_command("wc wc.txt")
+        assert result.split() == ["2", "6", "32", "wc.txt"], result
+        
+        result = self.terminal.execute_command("wc -l -m wc.txt wc.txt")
+        lines = result.splitlines()
+        assert lines[0].split() == ["2", "31", "wc.txt"], result
+        assert lines[-1].split() == ["4", "62", "total"]
+        
+        # Force tiny ranges so words straddle range boundaries
+        threshold = simple_terminal.WC_PARALLEL_THRESHOLD
+        simple_terminal.WC_PARALLEL_THRESHOLD = 1
+        try:
+            result = self.terminal.execute_command("wc wc.txt")
+        finally:
+            simple_terminal.WC_PARALLEL_THRESHOLD = threshold
+        assert result.split() == ["2", "6", "32", "wc.txt"], result
+        
+        os.remove(wc_file)
+        return "Word count working correctly"
+    
+    def test_structured_output(self):
+        """Test NDJSON output per command and for the whole session"""
+        print("\n🧾 Testing Structured Output")
+        self.terminal.current_dir = self.test_dir
+        
+        os.makedirs(os.path.join(self.test_dir, "json_dir"))
+        with open(os.path.join(self.test_dir, "json_file.txt"), 'w') as f:
+            f.write("12345")
+        
+        records = [json.loads(line) for line in self.terminal.execute_command("ls --json").splitlines()]
+        by_name = {record["name"]: record for record in records}
+        assert by_name["json_dir"]["type"] == "dir", records
+        assert by_name["json_file.txt"] == {"name": "json_file.txt", "type": "file", "size": 5}
+        
+        records = [json.loads(line) for line in self.terminal.execute_command("ps --json").splitlines()]
+        assert records and {"pid", "name", "cpu"} <= set(records[0])
+        
+        # The REPL's streaming path resets the status like any other command
+        self.terminal.execute_command("cat no_such_file.txt")
+        lines = list(self.terminal.record_stream("ls --json"))
+        assert json.loads(lines[0])["name"] and self.terminal.execute_command("echo $?") == "0"
+        
+        # Session mode wraps commands without record handlers
+        assert "on" in self.terminal.execute_command("json on")
+        assert json.loads(self.terminal.execute_command("pwd")) == {"path": self.test_dir}
+        assert json.loads(self.terminal.execute_command("echo hi")) == {"command": "echo", "output": "hi"}
+        assert "off" in self.terminal.execute_command("json off")
+        assert self.terminal.execute_command("pwd") == self.test_dir
+        
+        shutil.rmtree(os.path.join(self.test_dir, "json_dir"))
+        os.remove(os.path.join(self.test_dir, "json_file.txt"))
+        return "Structured output working correctly"
+    
+    def test_process_signalling(self):
+        """Test pgrep and pkill, including escalation to SIGKILL"""
+        print("\n🎯 Testing Process Signalling")
+        
+        marker = f"pkill_marker_{os.getpid()}"
+        polite = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)", marker])
+        stubborn = subprocess.Popen([sys.executable, "-c",
+                                     "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+                                     "print('ready', flush=True); time.sleep(60)", marker],
+                                    stdout=subprocess.PIPE)
+        stubborn.stdout.readline()
+        try:
+            result = self.terminal.execute_command(f"pgrep -f {marker}")
+            assert set(result.split()) == {str(polite.pid), str(stubborn.pid)}, result
+            
+            result = self.terminal.execute_command(f"pgrep {marker}")
+            assert result == "No matching processes"
+            
+            result = self.terminal.execute_command(f"pkill -t 0.5 -f {marker}")
+            assert "Sent SIGTERM to 2 process(es)" in result, result
+            assert "1 killed with SIGKILL" in result, result
+            assert polite.wait(timeout=5) is not None and stubborn.wait(timeout=5) is not None
+        finally:
+            for proc in (polite, stubborn):
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            stubborn.stdout.close()
+        
+        assert "Usage:" in self.terminal.execute_command("pgrep")
+        return "Process signalling working correctly"
+    
+    def test_io_and_network_top(self):
+        """Test iotop and nettop rankings"""
+        print("\n📈 Testing I/O and Network Ranking")
+        self.terminal.current_dir = self.test_dir
+        
+        # Generate some write traffic from this process while sampling
+        def write_traffic():
+            for _ in range(10):
+                with open(os.path.join(self.test_dir, "io.bin"), 'wb') as f:
+                    f.write(os.urandom(1024 * 1024))
+                time.sleep(0.02)
+        
+        writer = threading.Thread(target=write_traffic)
+        writer.start()
+        records = [json.loads(line) for line in
+                   self.terminal.execute_command("iotop --json -i 0.3 -n 50").splitlines()]
+        writer.join()
+        assert all("read_bytes_per_sec" in record for record in records), records
+        own = [record for record in records if record["pid"] == os.getpid()]
+        assert not own or own[0]["write_bytes_per_sec"] >= 0
+        
+        result = self.terminal.execute_command("iotop -i 0.1 -n 3")
+        assert "READ/s" in result or "No readable" in result or "Error" in result, result
+        
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        try:
+            records = [json.loads(line) for line in
+                       self.terminal.execute_command("nettop --json -i 0.1 -n 1000").splitlines()]
+            own = [record for record in records if record.get("pid") == os.getpid()]
+            assert own and own[0]["connections"] >= 1, records
+        finally:
+            server.close()
+        
+        assert "Usage:" in self.terminal.execute_command("nettop -x")
+        os.remove(os.path.join(self.test_dir, "io.bin"))
+        return "I/O and network ranking working correctly"
+    
+    def test_result_cache(self):
+        """Test memoization of pure commands and its invalidation"""
+        print("\n🗃️ Testing Result Cache")
+        self.terminal.current_dir = self.test_dir
+        
+        cached_file = os.path.join(self.test_dir, "cached.txt")
+        with open(cached_file, 'w') as f:
+            f.write("first")
+        
+        assert "Result cache on" in self.terminal.execute_command("cache on 1024")
+        try:
+            assert self.terminal.execute_command("cat cached.txt") == "first"
+            assert self.terminal.execute_command("cat cached.txt") == "first"
+            assert "1 hits, 1 misses" in self.terminal.execute_command("cache stats")
+            
+            # Changing the file's size and mtime invalidates the entry
+            with open(cached_file, 'w') as f:
+                f.write("second!")
+            os.utime(cached_file, ns=(0, 10 ** 9))
+            assert self.terminal.execute_command("cat cached.txt") == "second!"
+            
+            # New entries show up in a cached ls once the directory changes
+            self.terminal.execute_command("ls")
+            open(os.path.join(self.test_dir, "new_file.txt"), 'w').close()
+            assert "new_file.txt" in self.terminal.execute_command("ls")
+            
+            # Outputs beyond the byte budget are evicted oldest first
+            for word in ["alpha", "beta", "gamma"]:
+                self.terminal.execute_command(f"ascii text {word}")
+            assert self.terminal.result_cache.total_bytes <= 1024
+            assert self.terminal.result_cache.evictions > 0
+            
+            # Randomly drawn art is never served from the cache
+            misses = self.terminal.result_cache.misses
+            for prompt in ["random", "pattern"]:
+                self.terminal.execute_command(f"ascii {prompt}")
+            assert self.terminal.result_cache.misses == misses
+        finally:
+            self.terminal.execute_command("cache off")
+        
+        os.remove(cached_file)
+        os.remove(os.path.join(self.test_dir, "new_file.txt"))
+        return "Result cache working correctly"
+    
+    def test_parallel(self):
+        """Test parallel builtin with builtin and external commands"""
+        print("\n⚡ Testing Parallel")
+        self.terminal.current_dir = self.test_dir
+        
+        for i in range(4):
+            with open(os.path.join(self.test_dir, f"part{i}.txt"), 'w') as f:
+                f.write("line\n" * (i + 1))
+        
+        # Builtins run in worker processes; -k keeps input order
+        result = self.terminal.execute_command("parallel -j 2 -k wc -l ::: part0.txt part1.txt part2.txt part3.txt")
+        lines = result.splitlines()
+        assert [line.split()[0] for line in lines[:4]] == ["1", "2", "3", "4"], result
+        assert "4 job(s), 0 failed" in lines[4]
+        
+        # External commands report their own exit codes
+        records = [json.loads(line) for line in self.terminal.execute_command(
+            "parallel --json -j 3 sh -c 'exit {}' ::: 0 3 0").splitlines()]
+        assert sorted(record["exit_code"] for record in records) == [0, 0, 3], records
+        
+        with open(os.path.join(self.test_dir, "args.txt"), 'w') as f:
+            f.write("part0.txt\nmissing.txt\n")
+        result = self.terminal.execute_command("parallel -a args.txt cat")
+        assert "2 job(s), 1 failed" in result, result
+        assert "cat missing.txt" in result
+        
+        # Arguments with spaces stay one argument for builtins and external commands
+        with open(os.path.join(self.test_dir, "my part.txt"), 'w') as f:
+            f.write("spaced\n")
+        result = self.terminal.execute_command('parallel -k wc -l {} ::: "my part.txt"')
+        assert result.splitlines()[0].split() == ["1", "my", "part.txt"], result
+        result = self.terminal.execute_command('parallel -k /bin/cat ::: "my part.txt"')
+        assert result.splitlines()[0] == "spaced", result
+        
+        # A quoted one-argument template still runs the builtin it names
+        records = [json.loads(line) for line in self.terminal.execute_command(
+            "parallel --json 'hash -a md5 {}' ::: part0.txt").splitlines()]
+        assert records[0]["exit_code"] == 0 and "part0.txt" in records[0]["output"], records
+        
+        assert "Usage:" in self.terminal.execute_command("parallel echo")
+        
+        for name in ["part0.txt", "part1.txt", "part2.txt", "part3.txt", "args.txt", "my part.txt"]:
+            os.remove(os.path.join(self.test_dir, name))
+        return "Parallel working correctly"
+    
+    def test_command_limits(self):
+        """Test timeouts, rlimits and usage reports for system commands"""
+        print("\n🚧 Testing Command Limits")
+        self.terminal.current_dir = self.test_dir
+        
+        assert self.terminal.execute_command('timeout 2 "echo a | tr a b"').strip() == "b"
+        
+        started = time.monotonic()
+        result = self.terminal.execute_command("timeout 0.3 sleep 10")
+        assert "timed out after 0.3s" in result, result
+        assert time.monotonic() - started < 5
+        
+        # A child that lets go of its pipes is still bound by the timeout
+        started = time.monotonic()
+        result = self.terminal.execute_command('timeout 0.3 "exec >/dev/null 2>/dev/null; sleep 5"')
+        assert "timed out after 0.3s" in result, result
+        assert time.monotonic() - started < 3
+        
+        # Durations take coreutils suffixes, and options go to the system timeout
+        assert self.terminal.execute_command("timeout 1m echo hi").strip() == "hi"
+        result = self.terminal.execute_command("timeout 0.005m sleep 10")
+        assert "timed out after 0.3s" in result, result
+        assert self.terminal.execute_command("timeout -s KILL 5s echo hi").strip() == "hi"
+        self.terminal.execute_command("timeout -s KILL 0.3 sleep 10")
+        assert self.terminal.last_status == 137, self.terminal.last_status
+        
+        result = self.terminal.execute_command("ulimit -t 1 -v 1G -r on")
+        assert "CPU time:      1s" in result and "Address space: 1.0GB" in result, result
+        try:
+            result = self.terminal.execute_command(f"{sys.executable} -c \"print('limited')\"")
+            assert result.splitlines()[0] == "limited", result
+            assert "exit 0" in result and "max RSS" in result
+            
+            if simple_terminal.resource is not None:
+                # The CPU limit stops a busy loop well before the wall clock would
+                result = self.terminal.execute_command(f"{sys.executable} -c \"while True: pass\"")
+                assert "exit 0" not in result, result
+        finally:
+            self.terminal.execute_command("ulimit -t unlimited -v unlimited -r off")
+        
+        assert "Usage:" in self.terminal.execute_command("ulimit -q 3")
+        return "Command limits working correctly"
+    
+    def test_directory_navigation(self):
+        """Test cd -, ~, the directory stack and frecency jumps"""
+        print("\n🧭 Testing Directory Navigation")
+        self.terminal.current_dir = self.test_dir
+        
+        deep = os.path.join(self.test_dir, "projects", "alpha", "src")
+        other = os.path.join(self.test_dir, "projects", "beta")
+        os.makedirs(deep)
+        os.makedirs(other)
+        
+        assert "Changed to:" in self.terminal.execute_command("cd projects/alpha/src")
+        self.terminal.execute_command("cd ../../beta")
+        assert self.terminal.current_dir == other
+        self.terminal.execute_command("cd -")
+        assert self.terminal.current_dir == deep
+        
+        result = self.terminal.execute_command("cd ~")
+        assert self.terminal.current_dir == os.path.expanduser("~"), result
+        
+        self.terminal.current_dir = self.test_dir
+        self.terminal.execute_command("pushd projects/beta")
+        assert self.terminal.current_dir == other
+        assert self.terminal.dir_stack == [self.test_dir]
+        self.terminal.execute_command("popd")
+        assert self.terminal.current_dir == self.test_dir
+        assert "stack empty" in self.terminal.execute_command("popd")
+        
+        # src was visited once, beta twice; both match "proj"
+        self.terminal.execute_command("cd projects/beta")
+        assert self.terminal.execute_command("z -l proj").splitlines()[0].endswith("beta")
+        self.terminal.execute_command("z alp src")
+        assert self.terminal.current_dir == deep
+        
+        # A fresh session reads the persisted database
+        fresh = SimpleTerminal()
+        fresh.state_dir = self.terminal.state_dir
+        fresh.execute_command("z beta")
+        assert fresh.current_dir == other
+        assert "No remembered directory" in fresh.execute_command("z nothing_like_this")
+        
+        self.terminal.current_dir = self.test_dir
+        shutil.rmtree(os.path.join(self.test_dir, "projects"))
+        return "Directory navigation working correctly"
+    
+    def test_command_parser(self):
+        """Test quoting, variables, globbing, redirection and command lists"""
+        print("\n🧩 Testing Command Parser")
+        self.terminal.current_dir = self.test_dir
+        
+        with open(os.path.join(self.test_dir, "my file.txt"), 'w') as f:
+            f.write("spaced")
+        for name in ["a.py", "b.py", ".hidden.py"]:
+            open(os.path.join(self.test_dir, name), 'w').close()
+        
+        assert self.terminal.execute_command('cat "my file.txt"') == "spaced"
+        assert self.terminal.execute_command("cat my\\ file.txt") == "spaced"
+        
+        # Globs skip dotfiles and stay literal when quoted or escaped
+        assert self.terminal.execute_command("echo *.py") == "a.py b.py"
+        assert self.terminal.execute_command("echo '*.py' \\*.py") == "*.py *.py"
+        assert self.terminal.execute_command("echo *.nothing") == "*.nothing"
+        
+        self.terminal.execute_command("NAME=world")
+        assert self.terminal.execute_command('echo "hello $NAME" \'$NAME\' ${NAME}s') == "hello world $NAME worlds"
+        assert self.terminal.execute_command("echo ~") == os.path.expanduser("~")
+        assert self.terminal.execute_command('echo "\\$NAME" \\$NAME') == "$NAME $NAME"
+        
+        # Session variables reach system commands without being exported
+        self.terminal.execute_command("DIR=a.py")
+        assert self.terminal.execute_command("/bin/ls $DIR").strip() == "a.py"
+        assert self.terminal.execute_command("/bin/echo $DIR | tr a-z A-Z").strip() == "A.PY"
+        assert self.terminal.execute_command("/bin/sh -c 'echo [$DIR]'").strip() == "[]"
+        self.terminal.execute_command("unset DIR")
+        
+        assert self.terminal.execute_command("echo one; echo two") == "one\ntwo"
+        result = self.terminal.execute_command("cat missing.txt && echo yes || echo no")
+        assert result.endswith("no") and "yes" not in result, result
+        assert self.terminal.execute_command("echo $?") == "0"
+        
+        # Failures are explicit, whatever their message says
+        fresh = SimpleTerminal()
+        fresh.current_dir = self.test_dir
+        fresh.state_dir = self.terminal.state_dir
+        for command in ["popd", "pushd", "cd -", "pgrep no_such_process_name_xyz"]:
+            assert not fresh.execute_command(f"{command} && echo ran").endswith("ran"), command
+            assert fresh.execute_command("echo $?") == "1", command
+        assert fresh.execute_command("echo fine && echo ran") == "fine\nran"
+        
+        self.terminal.execute_command("echo first > out.txt")
+        self.terminal.execute_command("echo second >> out.txt")
+        with open(os.path.join(self.test_dir, "out.txt")) as f:
+            assert f.read() == "first\nsecond\n"
+        assert self.terminal.execute_command("echo hi 2> /nonexistent_dir/x").startswith("Error:")
+        assert self.terminal.execute_command("echo $?") == "1"
+        
+        # Pipelines still go to the system shell
+        assert self.terminal.execute_command("echo piped | tr a-z A-Z").strip() == "PIPED"
+        
+        # Descriptor duplication and heredocs are shell syntax too
+        result = self.terminal.execute_command("ls /nonexistent_dir 2>&1 | head -1")
+        assert "nonexistent_dir" in result and "Parse error" not in result, result
+        assert "Parse error" not in self.terminal.execute_command("echo a >&2")
+        assert self.terminal.execute_command("cat <<EOF\nhere doc\nEOF").strip() == "here doc"
+        assert self.terminal.execute_command("echo merged 2>&1") == "merged"
+        
+        assert "Parse error" in self.terminal.execute_command('echo "unterminated')
+        assert "Parse error" in self.terminal.execute_command("echo a &&")
+        
+        # Repeated lines are served from the parse cache
+        simple_terminal.parse_command_line.cache_clear()
+        for _ in range(3):
+            self.terminal.execute_command("echo cached")
+        assert simple_terminal.parse_command_line.cache_info().hits == 2
+        
+        for name in ["my file.txt", "a.py", "b.py", ".hidden.py", "out.txt"]:
+            os.remove(os.path.join(self.test_dir, name))
+        return "Command parser working correctly"
+    
+    def test_session_replay(self):
+        """Test recording a session and replaying it"""
+        print("\n🔁 Testing Session Recording and Replay")
+        self.terminal.current_dir = self.test_dir
+        
+        with open(os.path.join(self.test_dir, "replay.txt"), 'w') as f:
+            f.write("stable")
+        
+        assert "Recording" in self.terminal.execute_command("record start session.log")
+        self.terminal.execute_command("cat replay.txt")
+        self.terminal.execute_command("echo hello; pwd")
+        result = self.terminal.execute_command("record stop")
+        assert "Recorded 2 command(s)" in result, result
+        
+        # Lines the REPL streams as records are recorded too
+        self.terminal.execute_command("record start streamed.log")
+        lines = list(self.terminal.record_stream("pwd --json"))
+        result = self.terminal.execute_command("record stop")
+        assert "Recorded 1 command(s)" in result, result
+        _, streamed = simple_terminal._read_session_log(os.path.join(self.test_dir, "streamed.log"))
+        assert [(record[2], record[3]) for record in streamed] == [("pwd --json", lines[0])]
+        os.remove(os.path.join(self.test_dir, "streamed.log"))
+        
+        cwd, records = simple_terminal._read_session_log(os.path.join(self.test_dir, "session.log"))
+        assert cwd == self.test_dir
+        assert [record[2] for record in records] == ["cat replay.txt", "echo hello; pwd"]
+        assert records[1][3] == f"hello\n{self.test_dir}"
+        
+        result = self.terminal.execute_command("replay session.log --max -c 3")
+        assert "2 command(s) x 3 session(s)" in result, result
+        assert "Divergent outputs: 0 of 6" in result, result
+        
+        # Changed inputs show up as divergence
+        with open(os.path.join(self.test_dir, "replay.txt"), 'w') as f:
+            f.write("changed")
+        result = self.terminal.execute_command("replay session.log --max")
+        assert "Divergent outputs: 1 of 2" in result and "cat replay.txt" in result, result
+        
+        assert "Usage:" in self.terminal.execute_command("replay")
+        os.remove(os.path.join(self.test_dir, "replay.txt"))
+        os.remove(os.path.join(self.test_dir, "session.log"))
+        return "Session recording and replay working correctly"
+    
+    def test_syntax_highlighting(self):
+        """Test viewport highlighting against highlighting the whole file"""
+        print("\n🎨 Testing Syntax Highlighting")
+        self.terminal.current_dir = self.test_dir
+        
+        path = os.path.join(self.test_dir, "big.py")
+        with open(path, 'w') as f:
+            for i in range(250):
+                f.write(f'def f{i}(x):\n    """doc\n    {i}\n    """\n    return x + {i}\n')
+        
+        highlighted = simple_terminal.HighlightedFile(path)
+        page = highlighted.render(1000, 20)
+        assert len(page) == 20
+        if simple_terminal.pygments is not None:
+            import pygments
+            with open(path) as f:
+                full = pygments.highlight(f.read(), highlighted.lexer, highlighted.formatter).split("\n")
+            assert page == full[1000:1020]
+            assert 1000 in highlighted.checkpoints
+            # Resuming mid-file from a checkpoint inside a docstring stays correct
+            assert highlighted.render(1201, 3) == full[1201:1204]
+            assert "\033[" in self.terminal.execute_command("cat --color big.py")
+            
+            # ResumableLexing mirrors pygments' RegexLexer loop: same tokens, and the
+            # stack it exposes inside a multi-line string resumes to the same tokens
+            text = 'x = 1\ns = """doc\nstill doc\n"""\ny = 2\n'
+            lexer = highlighted.lexer
+            assert simple_terminal.ResumableLexing.supports(lexer)
+            expected = list(lexer.get_tokens_unprocessed(text))
+            lexing = simple_terminal.ResumableLexing(lexer, text)
+            offset = text.index("still")
+            states = {}
+            tokens = []
+            for token in lexing:
+                if token[0] == offset == lexing.match_start:
+                    states[offset] = tuple(lexing.stack)
+                tokens.append(token)
+            assert tokens == expected
+            assert states[offset] != ("root",), states
+            resumed = [(pos + offset, token_type, value) for pos, token_type, value
+                       in simple_terminal.ResumableLexing(lexer, text[offset:], states[offset])]
+            assert resumed == [token for token in expected if token[0] >= offset]
+        else:
+            assert "def f200(x):" in page
+        highlighted.close()
+        
+        first_page = re.sub(r"\033\[[0-9;]*m", "", self.terminal.execute_command("less big.py"))
+        assert first_page.startswith("def f0(x):"), first_page
+        assert "File not found" in self.terminal.execute_command("less missing.py")
+        os.remove(path)
+        return "Syntax highlighting working correctly"
+    
+    def test_compressed_files(self):
+        """Test cat, grep and wc on gzip, bzip2 and xz files"""
+        print("\n🗜️ Testing Compressed Files")
+        self.terminal.current_dir = self.test_dir
+        
+        import bz2, gzip, lzma
+        data = "".join(f"{i} {'error' if i % 3 == 0 else 'ok'}\n" for i in range(30000))
+        names = {"log.gz": gzip, "log.bz2": bz2, "log.xz": lzma}
+        for name, module in names.items():
+            with open(os.path.join(self.test_dir, name), 'wb') as f:
+                f.write(module.compress(data.encode()))
+        
+        for name in names:
+            assert self.terminal.execute_command(f"cat {name}") == data
+            assert self.terminal.execute_command(f"grep -c error {name}") == "10000"
+            assert self.terminal.execute_command(f"wc -l -w {name}").split() == ["30000", "60000", name]
+        assert self.terminal.execute_command("grep -n '^300 ' log.xz") == "301:300 error"
+        
+        # Text that merely starts like a bzip2 header is read as text
+        with open(os.path.join(self.test_dir, "bzh.txt"), 'w') as f:
+            f.write("BZh is a prefix\nsecond line\n")
+        assert self.terminal.execute_command("cat bzh.txt") == "BZh is a prefix\nsecond line\n"
+        assert self.terminal.execute_command("grep -c line bzh.txt") == "1"
+        
+        # No selected lines is a failed search; options the builtin lacks go to the system grep
+        self.terminal.execute_command("grep missing bzh.txt")
+        assert self.terminal.last_status == 1
+        assert self.terminal.execute_command("grep -c missing bzh.txt") == "0"
+        assert self.terminal.last_status == 1
+        assert "bzh.txt" in self.terminal.execute_command("grep -l line bzh.txt")
+        assert self.terminal.execute_command("grep -E 'prefix|second' bzh.txt").splitlines() == [
+            "BZh is a prefix", "second line"]
+        assert self.terminal.last_status == 0
+        os.remove(os.path.join(self.test_dir, "bzh.txt"))
+        
+        # Abandoning a stream stops its decompression thread; small chunks keep the
+        # queue full so the thread is still blocked when the stream is closed
+        chunk_size = simple_terminal.DECOMPRESS_CHUNK_SIZE
+        simple_terminal.DECOMPRESS_CHUNK_SIZE = 1024
+        try:
+            before = set(threading.enumerate())
+            chunks = simple_terminal._file_chunks(os.path.join(self.test_dir, "log.gz"))
+            next(chunks)
+            workers = set(threading.enumerate()) - before
+            assert len(workers) == 1, workers
+            chunks.close()
+            assert not any(worker.is_alive() for worker in workers)
+        finally:
+            simple_terminal.DECOMPRESS_CHUNK_SIZE = chunk_size
+        
+        for name in names:
+            os.remove(os.path.join(self.test_dir, name))
+        return "Compressed files working correctly"
+    
+    def test_external_sort(self):
+        """Test sort in memory and with spilled runs, and uniq -c"""
+        print("\n🔢 Testing External Sort")
+        self.terminal.current_dir = self.test_dir
+        
+        rows = [f"host{i % 7} {(i * 37) % 101 - 50} req{i}" for i in range(5000)]
+        with open(os.path.join(self.test_dir, "rows.txt"), 'w') as f:
+            f.write("\n".join(rows) + "\n")
+        
+        by_number = sorted(rows, key=lambda row: int(row.split()[1]))
+        # A tiny budget forces sorted runs on disk and multi-pass merging
+        fanin = simple_terminal.SORT_MERGE_FANIN
+        simple_terminal.SORT_MERGE_FANIN = 4
+        try:
+            for budget in ("", "-S 20K"):
+                assert self.terminal.execute_command(f"sort {budget} rows.txt").split("\n") == sorted(rows)
+                result = self.terminal.execute_command(f"sort -n -k 2 {budget} rows.txt")
+                assert result.split("\n") == by_number
+                result = self.terminal.execute_command(f"sort -r -n -k2,2 {budget} rows.txt")
+                assert result.split("\n") == sorted(rows, key=lambda row: int(row.split()[1]), reverse=True)
+                result = self.terminal.execute_command(f"sort -u -k1,1 {budget} rows.txt")
+                # The first row seen for each host survives
+                assert result.split("\n") == rows[:7], result
+        finally:
+            simple_terminal.SORT_MERGE_FANIN = fanin
+        
+        result = self.terminal.execute_command("sort -S 20K -o sorted.txt rows.txt")
+        assert "Sorted 5000 line(s)" in result, result
+        with open(os.path.join(self.test_dir, "sorted.txt")) as f:
+            assert f.read().split("\n")[:-1] == sorted(rows)
+        
+        with open(os.path.join(self.test_dir, "dups.txt"), 'w') as f:
+            f.write("a\na\nb\na\n")
+        assert self.terminal.execute_command("uniq -c dups.txt") == "      2 a\n      1 b\n      1 a"
+        assert "Usage:" in self.terminal.execute_command("sort -k 0 rows.txt")
+        
+        # Options the builtins lack are handed to the system sort and uniq
+        assert self.terminal.execute_command("uniq -d dups.txt").splitlines() == ["a"]
+        with open(os.path.join(self.test_dir, "fields.txt"), 'w') as f:
+            f.write("x,3\ny,1\nz,2\n")
+        assert self.terminal.execute_command("sort -t , -k 2 fields.txt").splitlines() == ["y,1", "z,2", "x,3"]
+        os.remove(os.path.join(self.test_dir, "fields.txt"))
+        for name in ("rows.txt", "sorted.txt", "dups.txt"):
+            os.remove(os.path.join(self.test_dir, name))
+        return "External sort working correctly"
+    
     def test_system_monitoring(self):
         """Test system monitoring features"""
         print("\n🖥️ Testing System Monitoring")
@@ -225,6 +1041,24 @@ class TerminalTestSuite:
             # Basic functionality tests
             self.run_test("Basic Commands", self.test_basic_commands)
             self.run_test("File Operations", self.test_file_operations)
+            self.run_test("Copy and Move", self.test_copy_and_move)
+            self.run_test("File Hashing", self.test_hash_files)
+            self.run_test("Disk Usage", self.test_disk_usage)
+            self.run_test("Locate", self.test_locate)
+            self.run_test("Watch", self.test_watch)
+            self.run_test("Word Count", self.test_word_count)
+            self.run_test("Structured Output", self.test_structured_output)
+            self.run_test("Process Signalling", self.test_process_signalling)
+            self.run_test("I/O and Network Ranking", self.test_io_and_network_top)
+            self.run_test("Result Cache", self.test_result_cache)
+            self.run_test("Parallel", self.test_parallel)
+            self.run_test("Command Limits", self.test_command_limits)
+            self.run_test("Directory Navigation", self.test_directory_navigation)
+            self.run_test("Command Parser", self.test_command_parser)
+            self.run_test("Session Replay", self.test_session_replay)
+            self.run_test("Syntax Highlighting", self.test_syntax_highlighting)
+            self.run_test("Compressed Files", self.test_compressed_files)
+            self.run_test("External Sort", self.test_external_sort)
             self.run_test("System Monitoring", self.test_system_monitoring)
             self.run_test("Help System", self.test_help_system)
             self.run_test("Error Handling", self.test_error_handling)